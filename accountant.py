@@ -3,29 +3,68 @@ functions. Our reconciliation code is here. Our monthly balance delta
 calculator is here.
 
 """
-import dateutil, sys
-from ledger import Balance
+import dateutil, re, sys
+from ledger import Balances
 from config import config as c
-from transactions import Transactions
+from namespace import Namespace
+import util as u
 class Monthly_Balancer():
     """TODO: print a better display when we are all balanced."""
-    def monthly_bal(self, account, display):
+    def monthly_bal(self, account, display, ledger=None):
+        """Compare each statement's ending balance to the ledger balance
+        of the account as of that statement's end date.
+
+        If ledger (a loaded Ledger) is given, we work out every month's
+        balance from it in memory with one sweep. Otherwise we get them
+        all from one ledger run with Balances.
+
+        """
+        cutoffs = [month['end_date'] + dateutil.relativedelta.relativedelta(days=1) for month in account.statements]
+        if ledger != None:
+            balances = self.balances(ledger, account.ledger_account, cutoffs)
+        else:
+            grid = Balances([account.ledger_account], cutoffs, opts="-C --effective")
+            balances = [grid[cutoff][account.ledger_account] for cutoff in cutoffs]
+
         first_continuous = None
         last = 0
-        for month in account.statements:
-            bal = Balance(search=account.ledger_account, opts="-C --effective -e " + month.get_date(month['end_date'] + dateutil.relativedelta.relativedelta(days=1)))
-            if bal.balance != month['summary']['ending balance']:
+        for month, balance in zip(account.statements, balances):
+            if balance != month['summary']['ending balance']:
                 if not first_continuous: 
                     last = 0
-                display.add(month.get_date(), month['summary']['ending balance'], bal.balance, last)
+                display.add(month.get_date(), month['summary']['ending balance'], balance, last)
                 if not first_continuous: 
                     first_continuous = month.get_date()
-                last = month['summary']['ending balance'] - bal.balance
+                last = month['summary']['ending balance'] - balance
             else:
                 # unbalanced months followed by balanced months are 
                 # month-boundary dating errors
                 first_continuous = None #month.get_date()
         display.done(first_continuous)
+
+    def balances(self, txs, search, cutoffs):
+        """Return the balance of cleared postings to accounts matching
+        search (a regex, like ledger's) before each date in cutoffs,
+        using effective (aux) dates. This is what `ledger -C
+        --effective -e <cutoff> balance <search>` would give us for each
+        cutoff, but it only walks the postings once: sort them by
+        date, sort the cutoffs, and advance through both together. With
+        NumPy, that's done on txs's columnar view instead.
+
+        """
+        pat = re.compile(search, re.I)
+        view = txs.columns() if hasattr(txs, 'columns') else None
+        if view is not None and view.exact:
+            mask = view.cleared() & view.accounts_matching(pat)
+            return view.totals_before(cutoffs, mask, effective=True)
+        postings = []
+        for tx in txs:
+            for posting in tx.postings:
+                if ((posting.state == "cleared" or tx.state == "cleared")
+                    and pat.search(posting.account_name)):
+                    date = posting.aux_date or tx.aux_date or tx.date
+                    postings.append((date, posting.amount))
+        return u.totals_before(postings, cutoffs)
     
 class Reconciler(object):
     """Given a couple Transactions objects, this class has tools to help
@@ -36,95 +75,118 @@ class Reconciler(object):
     def __init__(self, ledger, account):
         self.ledger = ledger
         self.account = account
-    def make_rows(self):
-        import dateutil
-        def get_increments(ledger, account):
-            ld = ledger[ledger.idx].get_date(posting=ledger_account_name, return_string=False) if ledger.idx < len(ledger) else dateutil.parser.parse("2099/01/01")
-            ad = account[account.idx].get_date(posting=ledger_account_name, return_string=False) if account.idx < len(account) else dateutil.parser.parse("2099/01/01")
-                
-            lbump = abump = False
-            if ledger.idx == len(ledger):
-                lbump = True
-            if account.idx == len(account):
-                abump = True
-            if ledger.idx < len(ledger) and account.idx < len(account) and self.total(ledger[ledger.idx])==self.total(account[account.idx]):
-                abump = lbump = True
-            if ld <= ad:
-                lbump = True
-            if ld >= ad:
-                abump = True
-            ledger.bump = False
-            if ledger.idx < len(ledger): ledger.bump = lbump
-            account.bump = False
-            if account.idx < len(account): account.bump = abump
-        uncleared = Transactions()
-        ret = ""
-        ledger_account_name = c['banks'][self.account.bank_name]['accounts'][self.account.name]['ledger-account'].lower()
-        while self.ledger.idx < len(self.ledger) or self.account.idx < len(self.account):
-            if self.ledger.idx < len(self.ledger):
-                if (self.ledger[self.ledger.idx]['state'] != "cleared" and 
-                    not "cleared" in [p['state'] for p in self.ledger[self.ledger.idx]['postings'] if p['account_name'].lower().startswith(ledger_account_name)]):
-                   uncleared.append(self.ledger[self.ledger.idx])
-                   self.ledger.idx += 1
-                   continue
-            get_increments(self.ledger, self.account)
-
-            if self.ledger.bump:
-                self.ledger.total.append(self.ledger.total[-1] + self.total(self.ledger[self.ledger.idx]))
-            if self.account.bump:
-                self.account.total.append(self.account.total[-1] + self.total(self.account[self.account.idx]))
-
-            if True:
-                # make table row
-                line = "<tr><td align='right'>"
-                if self.ledger.bump: line += '{0}<br />'
-                line += "</td><td>"
-                if self.account.bump: line += '{1}<br />'
-                line += "</td></tr>"
-                ret += line.format(self.ledger[self.ledger.idx] if self.ledger.idx<len(self.ledger) else "", 
-                                   self.account[self.account.idx] if self.account.idx < len(self.account) else "")
-                if self.ledger.total[-1] == self.account.total[-1]:
-                    ret += ("<tr><td align='right'><font color='green'>{0}</font><br /></td><td><font color='green'>{1}</font></td></tr>".
-                            format(self.ledger.total[-1], self.account.total[-1]))
-                else:
-                    if self.ledger.bump == self.account.bump == True:
-                        ret += ("<tr><td align='right'><font color='blue'>{0}</font><br /></td><td><font color='blue'>{1}</font></td></tr>".
-                                format(self.ledger.total[-1], self.account.total[-1]))
-                    else:
-                        ret += "<tr><td align='right'>{0}<br /></td><td>{1}</td></tr>".format(self.ledger.total[-1], self.account.total[-1])
-
-            if self.ledger.bump: self.ledger.idx += 1
-            if self.account.bump: self.account.idx += 1
-
-            # TODO: print the uncleared transactions in an intelligent way at the end.
-            #if len(self.ledger) >= self.ledger.idx and len(self.account) >= self.account.idx:
-            #    if len(uncleared) > 0:
-            #        for tx in uncleared:
-            #            print "<tr><td align='right'>{0}</td></tr>".format(tx)
-        return ret
+        self.ledger_account_name = c['banks'][self.account.bank_name]['accounts'][self.account.name]['ledger-account']
+
+    def prepare(self):
+        """Work out each tx's reconcile key once, in one pass over its
+        postings: (date, total, cleared), stored in self.keys by id(tx).
+
+        date is when the tx hit the bank account: the earliest aux date
+        of its postings to the account if there are any, else the tx's
+        aux date or date. total is the sum of those postings. cleared
+        is true if the tx or one of those postings is cleared.
+
+        """
+        prefix = self.ledger_account_name.lower()
+        self.keys = {}
+        for txs in [self.ledger, self.account]:
+            for tx in txs:
+                dates = []
+                amounts = []
+                cleared = tx.state == "cleared"
+                for p in tx.postings:
+                    if p.account_name.lower().startswith(prefix):
+                        amounts.append(p.amount)
+                        if p.aux_date: dates.append(p.aux_date)
+                        if p.state == "cleared": cleared = True
+                date = min(dates) if dates else (tx.aux_date or tx.date)
+                # Decimal math is slow, so don't add when there's one posting
+                total = amounts[0] if len(amounts) == 1 else sum(amounts)
+                self.keys[id(tx)] = (date, total, cleared)
+
+    def date(self, tx):
+        return self.keys[id(tx)][0]
 
     def total(self, tx):
-        return sum([p['amount'] for p in tx['postings'] if p['account_name'].lower().startswith("assets:checking")])
-
-    def reconcile(self):
-        def sorter(tx):
-            return (tx.get_date(posting=c['banks'][self.account.bank_name]['accounts'][self.account.name]['ledger-account'],
-                                return_string=False),
-                                abs(self.total(tx)))
-
-        ledger = self.ledger
-        account = self.account
-        account.sort(key=sorter)
-        ledger.sort(key=sorter)
-        self.ledger.idx = self.account.idx = 0
-        self.ledger.total = [0]
-        self.account.total = [0]
-
-        ret = "<html><body><table border='1'>"
-        ret += self.make_rows()
-        ret += "</table></body></html>"
-        ret = ret.replace("\n", "<br />\n")
-        import re
-        ret = re.sub(r"(Assets:Checking.*)<", "<font color='red'>\\1</font><", ret)
-        print ret
+        return self.keys[id(tx)][1]
+
+    def cleared(self, tx):
+        return self.keys[id(tx)][2]
+
+    def match(self, day_range=None):
+        """Pair each cleared ledger tx with a bank tx of the same amount
+        dated within day_range days of it (reconcile-day-range in
+        config.json, default 3).
+
+        The bank txs are indexed by amount and day, so finding the
+        candidates for a ledger tx is a handful of dict lookups, closest
+        day first, however big the account is. Each bank tx matches at
+        most once. A mismatch only leaves those two txs unmatched; it
+        doesn't throw off the rest of the pairing.
+
+        Returns a Namespace with lists of (ledger tx, bank tx) pairs in
+        matched, unmatched ledger txs in ledger, unmatched bank txs in
+        account and the ledger txs we skipped as not cleared in
+        uncleared.
+
+        """
+        if day_range == None:
+            day_range = c.get('reconcile-day-range', 3)
+        self.prepare()
+        keys = self.keys
+        offsets = [0]
+        for d in range(1, day_range+1):
+            offsets.extend([-d, d])
+
+        index = {} # amount -> day -> bank txs, so we hash each amount once
+        for tx in sorted(self.account, key=self.date):
+            (date, total, cleared) = keys[id(tx)]
+            index.setdefault(total, {}).setdefault(date.toordinal(), []).append(tx)
+
+        ret = Namespace({'matched':[], 'ledger':[], 'account':[], 'uncleared':[]})
+        matched = set()
+        for tx in sorted(self.ledger, key=self.date):
+            (date, amount, cleared) = keys[id(tx)]
+            if not cleared:
+                ret.uncleared.append(tx)
+                continue
+            day = date.toordinal()
+            days = index.get(amount, {})
+            for offset in offsets:
+                candidates = days.get(day+offset)
+                if candidates:
+                    atx = candidates.pop(0)
+                    matched.add(id(atx))
+                    ret.matched.append((tx, atx))
+                    break
+            else:
+                ret.ledger.append(tx)
+        ret.account = [tx for tx in self.account if not id(tx) in matched]
+        return ret
+
+    def rows(self, result):
+        """Yield the result of match() as rows in date order, each a
+        Namespace with the row's date, its ledger and bank txs (either
+        can be None) and the running totals of each side after it."""
+        keys = self.keys
+        rows = ([(keys[id(l)][0], abs(keys[id(l)][1]), l, a) for l, a in result.matched]
+                + [(keys[id(l)][0], abs(keys[id(l)][1]), l, None) for l in result.ledger]
+                + [(keys[id(a)][0], abs(keys[id(a)][1]), None, a) for a in result.account])
+        rows.sort(key=lambda row: row[:2])
+
+        ledger_total = account_total = 0
+        for date, amount, ltx, atx in rows:
+            if ltx: ledger_total += keys[id(ltx)][1]
+            if atx: account_total += keys[id(atx)][1]
+            yield Namespace({'date':date, 'ledger':ltx, 'account':atx,
+                             'ledger_total':ledger_total, 'account_total':account_total})
 
+    def reconcile(self, display):
+        """Match the ledger to the account and hand the rows to display
+        (a display.Reconcile) one at a time as we go."""
+        result = self.match()
+        display.start(self.ledger_account_name)
+        for row in self.rows(result):
+            display.add(row)
+        # TODO: print the uncleared transactions in an intelligent way at the end.
+        display.done(result)
@@ -9,15 +9,16 @@ __author__ = "James Vasile <james@jamesvasile.com>"
 __version__ = "0.2.1"
 __license__ = "AGPLv3+"
 
-import os, sys
+import dates, os, sys
 
 from config import config as c
 from banks import Banks
 from ledger import Ledger
+from cache import Cache
 from errs import ConfigError
 from accountant import Monthly_Balancer, Reconciler 
 import dispatch
-import display, display_cl, display_csv
+import display, display_cl, display_csv, display_html
 import util as u
 from logger import logger
 log = logger.get_logger()
@@ -46,6 +47,8 @@ def parse_args():
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='be more verbose about status messages')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='be quieter and print fewer status messages')
     parser.add_argument('--csv', action='store_true', default=False, help='output in csv format')
+    parser.add_argument('--html', action='store_true', default=False, help='output in html format (reconcile only)')
+    parser.add_argument('--text', action='store_true', default=False, help='output plain text (reconcile only, which defaults to html)')
     parser.add_argument('-h', '--help', action='store_true', help='display this help message. Specify a command for detailed help on that command.')
 
     # Run the argument parser
@@ -111,8 +114,13 @@ class Dispatch(dispatch.Dispatch):
         # class yet. We'll do that in the actual command methods
         # below.
         self.display = display_cl # cli is the default display
+        self.reconcile_display = display_html # except for reconcile
+        if kwargs.setdefault('text', None):
+            self.reconcile_display = display_cl
         if kwargs.setdefault('csv', None):
-            self.display = display_csv # but the user can choose csv
+            self.display = self.reconcile_display = display_csv # but the user can choose csv
+        if kwargs.setdefault('html', None):
+            self.display = self.reconcile_display = display_html # or html
     def _load_banks(self):
         log.info( "Loading bank statements" )
         if not self.banks:
@@ -143,10 +151,22 @@ class Dispatch(dispatch.Dispatch):
                 self.monthly_bal(accounts = bank)
             return
 
-        # do the monthly balance thing for all the accounts
+        # do the monthly balance thing for all the accounts. By default
+        # ledger works out every month-end balance in one run. If
+        # monthly-bal-in-memory is turned on in config.json, we load
+        # the account's postings once and sweep through them instead.
+        # That's faster, but it doesn't apply automated or periodic
+        # transactions or `apply account` directives the way ledger's
+        # balance query does, so it's only safe for journals that
+        # don't use them.
         accountant = Monthly_Balancer()
         for name, account in kwargs['accounts'].items():
-            accountant.monthly_bal(account, self.display.Monthly_Bal())
+            ledger = None
+            if c.get('monthly-bal-in-memory', False):
+                log.info( "Loading ledger." )
+                ledger = Ledger(search=account.ledger_account)
+                ledger.load()
+            accountant.monthly_bal(account, self.display.Monthly_Bal(), ledger)
 
     def reconcile(self, **kwargs):
         """Match transactions in the ledger and bank statements.
@@ -156,26 +176,57 @@ class Dispatch(dispatch.Dispatch):
          * ledger -f Chase_Bank-Preferred_Business_Checking.ledger --sort 'date' print
          * ledger -f main.ledger --sort 'date' print
 
+        Rows are written as they're matched, as a two column html
+        table. Use --csv for a spreadsheet or --text for plain text.
+        Every account goes into the one report.
+
         """
 
 
         # If a set of accounts hasn't been provided, load them here.
-        if not kwargs.setdefault('accounts', None):
+        if kwargs.setdefault('accounts', None):
+            accounts = kwargs['accounts'].values()
+        else:
             self._load_banks()
-            for name, bank in self.banks.items():
-                kwargs['accounts'] = bank
-                self.reconcile(**kwargs)
-            return
-
-        begin_date = ""
-        if 'begin_date' in kwargs and kwargs['begin_date']: begin_date = " -b " + kwargs['begin_date']
+            accounts = [account for bank in self.banks.values() for account in bank.values()]
+
+        # Filter by date in memory rather than passing -b to ledger,
+        # so the cached parse is the same whatever the begin date.
+        begin_date = None
+        if 'begin_date' in kwargs and kwargs['begin_date']: begin_date = dates.parse(kwargs['begin_date'])
+
+        display = self.reconcile_display.Reconcile()
+        try:
+            for account in accounts:
+                log.info( "Loading ledger." )
+                ledger = Ledger(search=account.ledger_account, opts = "--related-all")
+                ledger.load()
+                if begin_date:
+                    ledger = ledger.between(begin_date)
+                reconciler = Reconciler(ledger, account)
+                reconciler.reconcile(display)
+        finally:
+            display.close()
+
+    def cache(self, **kwargs):
+        """List what's in the parse caches. `cache purge` empties them.
+
+        Anvil keeps the transactions it parses out of each journal file
+        in a cache under cache-dir (see config.json) and only reparses a
+        file when its contents change. This command lists the cached
+        entries. Give it the argument `purge` to delete them all, e.g.
+        if you suspect the cache is wrong.
 
-        for name, account in kwargs['accounts'].items():
-            log.info( "Loading ledger." )
-            ledger = Ledger(search=account.ledger_account, opts = "--related-all" + begin_date)
-            ledger.load()
-            reconciler = Reconciler(ledger, account)
-            reconciler.reconcile()
+        """
+        purge = 'purge' in kwargs.setdefault('args', [])
+        display = self.display.Cache()
+        for name in Cache.names():
+            cache = Cache(name)
+            for entry in cache.entries():
+                display.add(entry)
+            if purge:
+                cache.purge()
+        display.done(purge)
 
     def nop(self, **kwargs):
         """Do nothing. Used for tests. Limits execution to main.
@@ -2,15 +2,23 @@
 it would get passed in on object creation.
 
 """
-import dateutil.parser, glob, os, re, subprocess, sys
+import dates, glob, multiprocessing, os, re, shutil, subprocess, sys, tempfile
+from multiprocessing.pool import ThreadPool
+import simplejson as json
+from collections import OrderedDict
 from decimal import Decimal
 from util import pp, pf
 
 from config import config as c
+from cache import Cache, file_hash
 from transactions import Posting, Transaction, Transactions
 from errs import ParseError
+import money
 import util as u
 
+from logger import logger
+log = logger.get_logger()
+
 class Statement(dict):
     """This is a set of routines that represent a Chase bank statement. We
     might want to make a standard API for how we handle statements,
@@ -20,6 +28,11 @@ class Statement(dict):
     """
     amount_pat = re.compile("\$? ?-? ?[.,\d]+$")
 
+    # Bump this whenever parse() would produce something different, so
+    # cached statements from the old parser get ignored. That includes
+    # the pickled shape of the Transactions it makes.
+    version = 2
+
     def __init__(self, fname, ledger_account):
         dict.__init__(self)
         self.fname = fname
@@ -42,16 +55,14 @@ class Statement(dict):
         line = self.text[0]
         if "through" in line:
             (fore, aft) = line.split("through")
-            self['start_date'] = dateutil.parser.parse(fore)
-            self['end_date'] = dateutil.parser.parse(aft)
+            self['start_date'] = dates.parse(fore)
+            self['end_date'] = dates.parse(aft)
         else:
             raise ParseError("Couldn't find statement date for %s" % self.fname)
 
-    def parse_account_num(self):
-        for line in self.text:
-            if "Account Number" in line:
-                self['account_num'] = Decimal(line.split("Account Number:")[1].strip())
-                return
+    def parse_account_num(self, line):
+        if "Account Number" in line:
+            self['account_num'] = Decimal(line.split("Account Number:")[1].strip())
 
     def get_date(self, field="end_date"):
         try:
@@ -63,36 +74,40 @@ class Statement(dict):
     def get_start_date(self):
         return self.get_date("start_date")
 
-    def parse_checking_summary(self, line_no, undef):
-        while line_no <= len(self.text) and not self.text[line_no].startswith(" CHECKING SUMMARY"):
-            line_no += 1
-        fields = ["Beginning Balance", "Ending Balance", "Checks Paid", 
-                  "Deposits and Additions", "ATM & Debit Card Withdrawals", 
-                  "Electronic Withdrawals", "Fees and Other Withdrawals"]
+    # The section handlers below come in pairs. start_foo(field) gets
+    # called on the section's heading line and sets up self[field].
+    # foo_line(line, field) then gets every following line until it
+    # returns False to say the section is over. Sections can overlap
+    # (e.g. checks paid runs to the next blank line, whatever headings
+    # it passes on the way), so parse() keeps them all going at once.
+
+    summary_fields = ["Beginning Balance", "Ending Balance", "Checks Paid", 
+                      "Deposits and Additions", "ATM & Debit Card Withdrawals", 
+                      "Electronic Withdrawals", "Fees and Other Withdrawals"]
+    summary_prefixes = [(" " + field, field.lower()) for field in summary_fields]
+
+    def start_checking_summary(self, field):
         if not 'summary' in self:
             self['summary'] = {}
-        for field in fields:
-            for line in self.text[line_no:]:
-                if line.startswith(" " + field):
-                    amt = Decimal(re.findall(self.amount_pat, line)[0].replace(",","").replace("$", "").replace(" ",""))
-                    self['summary'][field.lower()] = amt
-                if not field.lower() in self['summary']:
-                    self['summary'][field.lower()] = 0
-                if line.startswith(" Ending Balance"): 
-                    last_line = self.text[line_no:].index(line)
-                    break
-        return last_line+line_no+1
-
-
-    def parse_daily_balance(self, line_no, field):
+        for prefix, key in self.summary_prefixes:
+            self['summary'].setdefault(key, 0)
+
+    def checking_summary_line(self, line, field):
+        for prefix, key in self.summary_prefixes:
+            if line.startswith(prefix):
+                self['summary'][key] = money.parse(re.findall(self.amount_pat, line)[0])
+        return not line.startswith(" Ending Balance")
+
+    def start_daily_balance(self, field):
         self[field] = []
-        for line in self.text[line_no+1:]:
-            if line in '\x0c\n':
-                break
 
-            (date, amt) = line.rsplit(" ",1)
-            if self.amount_pat.match(amt):
-                self[field].append({self.complete_date(date):Decimal(amt.replace(",","").replace("$","").replace(" ",""))}) # date:amt
+    def daily_balance_line(self, line, field):
+        if line in '\x0c\n':
+            return False
+        (date, amt) = line.rsplit(" ",1)
+        if self.amount_pat.match(amt):
+            self[field].append({self.complete_date(date):money.parse(amt)}) # date:amt
+        return True
 
     def complete_date(self, date):
         """Given a month/year in \d\d/\d\d format, use the statement start and
@@ -106,110 +121,111 @@ class Statement(dict):
         if (self['start_date'].year != self['end_date'].year
             and int(date.split('/')[0]) == 12):
             year = self['start_date'].year
-        return dateutil.parser.parse(str(year)+"/"+ date)
-
-    def parse_entries_neg(self, line_no, field):
-        self.parse_entries(line_no, field, neg=True)
-        
-    def parse_entries(self, line_no, field, neg=False):
-        if neg:
-            neg = -1
-        else:
-            neg = 1
+        return dates.parse(str(year)+"/"+ date)
 
+    def start_entries(self, field):
         # This should take care of a repeated section
         if not field in self:
             self[field] = Transactions()
 
-        entry_pat = re.compile("^(\d\d/\d\d) *(.*?)(\$?) ?([-.,\d]+)$")
-        for line in self.text[line_no+1:]:
-            if self.unknown_section(line): break
-            m = entry_pat.match(line)
+    entry_pat = re.compile("^(\d\d/\d\d) *(.*?)(\$?) ?([-.,\d]+)$")
+    purchase_pat = re.compile("Purchase *(\d\d/\d\d)")
+
+    def entries_neg_line(self, line, field):
+        return self.entries_line(line, field, neg=True)
+
+    def entries_line(self, line, field, neg=False):
+        if self.unknown_section(line):
+            return False
+        m = self.entry_pat.match(line)
+        if m:
+            parts = m.groups()
+            descrip = parts[1].strip()
+            amt = money.parse(parts[3]) * (-1 if neg else 1)
+            m = self.purchase_pat.search(descrip)
             if m:
-                parts = m.groups()
-                descrip = parts[1].strip()
-                amt = Decimal(parts[3].replace(",","").replace("$","")) * neg
-                m = re.search("Purchase *(\d\d/\d\d)", descrip)
-                if m:
-                    date = self.complete_date(m.groups()[0])
-                    aux_date = self.complete_date(parts[0])
-                    descrip = descrip.split(m.groups()[0],1)[1].strip()
-                else:
-                    aux_date = None
-                    date = self.complete_date(parts[0])
-
-                tx = Transaction(**{'date':date,
-                                    'aux_date':aux_date,
-                                    'payee':descrip,
-                                    'file':self.fname,
-                                    #'tags':{'section':field}
-                                })
-                tx['postings'] = [Posting(**{'commodity':'$',
-                                             'amount':amt,
-                                             'account_name':self.ledger_account + ':' +field,
-                                             'tx':tx}),
-                                  Posting(**{'commodity':'$',
-                                             'amount':amt*-1,
-                                             'account_name':'Liabilities:'+field,
-                                             'tx':tx}),
-                              ]
-                self[field].append(tx)
-    def parse_checks_paid(self, line_no, field):
+                date = self.complete_date(m.groups()[0])
+                aux_date = self.complete_date(parts[0])
+                descrip = descrip.split(m.groups()[0],1)[1].strip()
+            else:
+                aux_date = None
+                date = self.complete_date(parts[0])
+
+            tx = Transaction(**{'date':date,
+                                'aux_date':aux_date,
+                                'payee':descrip,
+                                'file':self.fname,
+                                #'tags':{'section':field}
+                            })
+            tx['postings'] = [Posting(**{'commodity':'$',
+                                         'amount':amt,
+                                         'account_name':self.ledger_account + ':' +field,
+                                         'tx':tx}),
+                              Posting(**{'commodity':'$',
+                                         'amount':amt*-1,
+                                         'account_name':'Liabilities:'+field,
+                                         'tx':tx}),
+                          ]
+            self[field].append(tx)
+        return True
+
+    def start_checks_paid(self, field):
         self[field] = Transactions()
-        check_pat = re.compile("^(\d+) *(\^?) *(.*?) *(\d\d/\d\d) *(\$?) *([-,.\d]+)")
-        date_amount_pat = re.compile("(\d\d/\d\d) *(\$?) *([-,.\d]+)$")
-        for line in self.text[line_no+1:]:
-            if line in '\x0c\n':
-                break
-            m = check_pat.match(line)
-            if m:
-                parts = m.groups()
-                n = date_amount_pat.search(line)
-                if n:
-                    da_parts = n.groups()
-                    amt = Decimal(da_parts[2].replace(",",""))
-                tx = Transaction(**{
-                    'code':parts[0],
-                    'payee':"Check for $%s" % u.moneyfmt(amt),
-                    'note':parts[2].strip(),
-                    'date':self.complete_date(da_parts[0]),
-                    })
-                tx['postings']=[Posting(**{'commodity':da_parts[1] if da_parts[1] else "$",
-                                           'account_name':'Income:'+field,
-                                           'amount':amt,
-                                           'tx':tx,
-                                       }),
-                                Posting(**{'commodity':da_parts[1] if da_parts[1] else "$",
-                                           'account_name':self.ledger_account + ':' +field,
-                                           'amount':amt * -1,
-                                           'tx':tx,
-                                       }),
-                            ]
-
-                self[field].append(tx)
+
+    check_pat = re.compile("^(\d+) *(\^?) *(.*?) *(\d\d/\d\d) *(\$?) *([-,.\d]+)")
+    date_amount_pat = re.compile("(\d\d/\d\d) *(\$?) *([-,.\d]+)$")
+
+    def checks_paid_line(self, line, field):
+        if line in '\x0c\n':
+            return False
+        m = self.check_pat.match(line)
+        if m:
+            parts = m.groups()
+            n = self.date_amount_pat.search(line)
+            if n:
+                da_parts = n.groups()
+                amt = money.parse(da_parts[2])
+            tx = Transaction(**{
+                'code':parts[0],
+                'payee':"Check for $%s" % u.moneyfmt(money.to_decimal(amt)),
+                'note':parts[2].strip(),
+                'date':self.complete_date(da_parts[0]),
+                })
+            tx['postings']=[Posting(**{'commodity':da_parts[1] if da_parts[1] else "$",
+                                       'account_name':'Income:'+field,
+                                       'amount':amt,
+                                       'tx':tx,
+                                   }),
+                            Posting(**{'commodity':da_parts[1] if da_parts[1] else "$",
+                                       'account_name':self.ledger_account + ':' +field,
+                                       'amount':amt * -1,
+                                       'tx':tx,
+                                   }),
+                        ]
+
+            self[field].append(tx)
+        return True
+
+    known_texts_pat = re.compile("|".join([re.escape(txt) for txt in [
+        "CUSTOMER SERVICE", "BROOKLYN", "TRANSACTIONS FOR SERVICE FEE CALCULATION", "SERVICE CHARGE SUMMARY"
+        , "WHAT YOU NEED TO KNOW ABOUT OVERDRAFTS"
+        ,"SERVICE CHARGE DETAIL" # Pretty sure service fees are assessed in next statement, so we can ignore in this one
+        , "SERVICE FEE CALCULATION" # Pretty sure service fees are assessed in next statement, so we can ignore in this one
+    ]]))
+    not_heading_pat = re.compile("|".join(["\d", "DESCRIPTION", "^[ \t\n]*$", "^[ \d]+$", "INSTANCES *AMOUNT", "DATE *AMOUNT"]))
 
     def unknown_section(self, line):
-            if (not line
-                or line == '\x0c'
-                or (line.upper() != line)
-            ):
-                return False
-            try:
-                if dateutil.parser.parse(line.split(" ")[0]):
-                    return False
-            except TypeError:
-                pass
-            for txt in ["CUSTOMER SERVICE", "BROOKLYN", "TRANSACTIONS FOR SERVICE FEE CALCULATION", "SERVICE CHARGE SUMMARY"
-                        , "WHAT YOU NEED TO KNOW ABOUT OVERDRAFTS"
-                        ,"SERVICE CHARGE DETAIL" # Pretty sure service fees are assessed in next statement, so we can ignore in this one
-                        , "SERVICE FEE CALCULATION" # Pretty sure service fees are assessed in next statement, so we can ignore in this one
-            ]:
-                if txt in line:
-                    return False
-            for regex in ["\d", "DESCRIPTION", "^[ \t\n]*$", "^[ \d]+$", "INSTANCES *AMOUNT", "DATE *AMOUNT"]:
-                if re.search(regex, line):
-                    return False
-            return True
+        """True if line looks like a section heading we don't know about:
+        all caps, not starting with a date and not one of the headings
+        or column titles we know we can ignore."""
+        if (not line
+            or line == '\x0c'
+            or (line.upper() != line)
+            or self.not_heading_pat.search(line)
+            or self.known_texts_pat.search(line)
+        ):
+            return False
+        return dates.try_parse(line.split(" ")[0]) is None
 
     def get_txs(self):
         txs = Transactions()
@@ -218,36 +234,50 @@ class Statement(dict):
             if field in self:                
                 txs.extend(self[field])
         return txs
+
+    # These result in ledger entries, as they affect the account balance
+    ledger_sections = {
+        "DEPOSITS AND ADDITIONS":"entries",
+        "ELECTRONIC WITHDRAWALS":"entries_neg",
+        "FEES AND OTHER WITHDRAWALS":"entries_neg",
+        "ATM & DEBIT CARD WITHDRAWALS":"entries_neg",
+        "CHECKS PAID":"checks_paid",
+    }
+    sections = {" CHECKING SUMMARY":"checking_summary",
+                "DAILY ENDING BALANCE":"daily_balance"}
+    sections.update(ledger_sections)
+    section_names = ledger_sections.keys()
+    heading_pat = re.compile("|".join([re.escape(heading) for heading in sections]))
+
     def parse(self):
+        """Walk the statement text once. Each line goes to every section
+        that is still open, then gets checked against the section
+        headings with one compiled pattern. Lines that aren't headings
+        and look like one we don't know about are an error.
 
+        """
         self.parse_date()
-        self.parse_account_num()
-        sections = {" CHECKING SUMMARY":self.parse_checking_summary,
-                    "DAILY ENDING BALANCE":self.parse_daily_balance}
-        
-        # These result in ledger entries, as they affect the account balance
-        ledger_sections = {
-            "DEPOSITS AND ADDITIONS":self.parse_entries,
-            "ELECTRONIC WITHDRAWALS":self.parse_entries_neg,
-            "FEES AND OTHER WITHDRAWALS":self.parse_entries_neg,
-            "ATM & DEBIT CARD WITHDRAWALS":self.parse_entries_neg,
-            "CHECKS PAID":self.parse_checks_paid,
-        }
-        self.section_names = ledger_sections.keys()
-        sections.update(ledger_sections)
-
-        line_no = 0
+        active = OrderedDict() # field -> line handler of the open sections
         for line in self.text:
-            found = False
-            for k,v in sections.items():
-                if line.startswith(k): 
-                    v(line_no, k.lower().strip())
-                    found = True
-                    break
-            if not found and self.unknown_section(line):
+            for field, handler in active.items():
+                if not handler(line, field):
+                    del active[field]
+
+            if not 'account_num' in self:
+                self.parse_account_num(line)
+
+            m = self.heading_pat.match(line)
+            if m:
+                kind = self.sections[m.group(0)]
+                field = m.group(0).lower().strip()
+                getattr(self, "start_" + kind.replace("_neg", ""))(field)
+                active.pop(field, None)
+                active[field] = getattr(self, kind + "_line")
+            elif self.unknown_section(line):
                 raise ParseError("Found what might be an unrecognized section heading in %s: %s" % (self.fname, line))
                 # TODO: maybe look at the next line to see if it looks like a tx
-            line_no += 1
+        if 'checking summary' in active:
+            raise ParseError("Checking summary in %s has no ending balance" % self.fname)
 
         # Make sure the sums are sane. Complain about parse errors it they're not
         sum = self['summary']['beginning balance']
@@ -259,14 +289,58 @@ class Statement(dict):
                     raise ParseError("Statement %s has a section that isn't in the summary: %s" % (self.fname, field))
                 if s != self['summary'][field]:
                     raise ParseError("Sum of transactions of (%s) in %s's \"%s\" section doesn't match summary at top of statment (%s)." % 
-                                     (s, self.fname, field, self['summary'][field]))
+                                     (money.to_decimal(s), self.fname, field, money.to_decimal(self['summary'][field])))
                 sum += s
         if sum != self['summary']['ending balance']:
-            raise ParseError("Sum of transactions doesn't yield ending balance in %s (%s vs %s)" % (self.fname, sum, self['summary']['ending balance']))
+            raise ParseError("Sum of transactions doesn't yield ending balance in %s (%s vs %s)" % (self.fname, money.to_decimal(sum), money.to_decimal(self['summary']['ending balance'])))
 
     def __str__(self):
         return str(dict(self))
 
+    def __getstate__(self):
+        """Don't pickle the statement text. Once parsed we don't need it."""
+        state = dict(self.__dict__)
+        state.pop('text', None)
+        return state
+
+def load_statement(fname, ledger_account, cache=None):
+    """Return a parsed Statement for the PDF fname.
+
+    If cache (a Cache) is given, look the statement up by the PDF's
+    sha1 and the parser version first, and store it there after
+    parsing if it wasn't found. Statements never change once
+    downloaded, so this means each PDF only ever gets parsed once.
+
+    We parse the .txt next to the PDF when there is one, and people
+    fix bad pdftotext output by editing it, so its sha1 is part of
+    the key too.
+
+    """
+    def text_sha1():
+        text = os.path.splitext(fname)[0]+".txt"
+        return file_hash(text) if os.path.exists(text) else None
+
+    if cache:
+        stamp = cache.stamp(fname)
+        key = (stamp['sha1'], text_sha1(), Statement.version, ledger_account)
+        statement = cache.get(key, fname)
+        if statement != None:
+            # Same content, but the file might have been moved since
+            statement.fname = fname
+            statement.fname_text = os.path.splitext(fname)[0]+".txt"
+            for tx in statement.get_txs():
+                if tx['file']:
+                    tx['file'] = fname
+            return statement
+
+    statement = Statement(fname, ledger_account)
+    statement.parse()
+    if cache:
+        # Statement may have just made the .txt
+        key = (stamp['sha1'], text_sha1(), Statement.version, ledger_account)
+        cache.put(key, stamp, statement)
+    return statement
+
 class Account(Transactions):
     """This is, at heart, a Transactions class: a list of txs that we can
     represent in a number of ways. The routines here are specific to
@@ -287,7 +361,6 @@ class Account(Transactions):
     """
 
     def __init__(self, **kwargs):
-        self.rename_pdfs()
         self.statements = []
         self.statements_dir = kwargs['statements-dir']
         self.bank_name = kwargs['bank-name']
@@ -297,30 +370,125 @@ class Account(Transactions):
         self.config = c['banks'][self.bank_name]['accounts'][self.name]
         Transactions.__init__(self)
 
-    def rename_pdf(self, fname):
-        """Take a pdf containing a monthly statement, find the end date of the statement and rename the PDF to YYYY_MM.pdf"""
+    def intake(self, pattern=None):
+        """Move newly downloaded statement PDFs (files matching pattern in
+        the current directory) into statements-dir. pattern defaults to
+        the account's intake-pattern in config.json, or
+        StatementPdf*.pdf.
+
+        Several accounts can share one download directory. If the
+        account has an account-num in config.json, PDFs for any other
+        account number are left where they are for that account's
+        intake to find.
 
-        for line in subprocess.check_output("pdftotext -layout %s -" % u.shellquote(fname), shell=True).split("\n"):
-            if "through" in line:
-                rename =  '_'.join(str(dateutil.parser.parse(line.split("through")[1])).split('-')[0:2]) + ".pdf"
-                break
-        if len(rename) != 11:
-            raise ParseError("Can't get date of Statement pdf file %s for rename (got %s)" % (fname, rename))
-        os.rename(fname, rename)
-        return rename
+        Each PDF goes through pdftotext once, on a pool of threads. We
+        read the statement's end date from that text, write the text
+        to statements-dir/YYYY_MM.txt (so Statement never needs to run
+        pdftotext again) and then move the PDF to YYYY_MM.pdf. Both
+        land under a temp name first and get renamed into place.
 
-    def rename_pdfs(self):
-        for fname in glob.glob("StatementPdf*.pdf"):
-            self.rename_pdf(fname)
+        A manifest in statements-dir remembers the sha1 of every PDF
+        we've taken in, so a PDF that's already been processed is
+        left alone. So is one identical to the YYYY_MM.pdf already in
+        statements-dir. Returns the list of new statement file names.
+
+        """
+        if not pattern:
+            pattern = self.config.get('intake-pattern', "StatementPdf*.pdf")
+        account_num = self.config.get('account-num')
+        if account_num != None:
+            account_num = Decimal(str(account_num))
+        fnames = sorted(glob.glob(pattern))
+        if not fnames:
+            return []
+        manifest_fname = os.path.join(self.statements_dir, ".intake.json")
+        manifest = {}
+        if os.path.exists(manifest_fname):
+            manifest = json.loads(u.slurp(manifest_fname, split=False))
+
+        todo = []
+        for fname in fnames:
+            sha1 = file_hash(fname)
+            if sha1 in manifest:
+                log.info("Already took in %s as %s, leaving it alone" % (fname, manifest[sha1]))
+                continue
+            todo.append((fname, sha1))
+
+        workers = ThreadPool(max(1, min(len(todo), multiprocessing.cpu_count())))
+        try:
+            texts = workers.map(extract_pdf, [fname for fname, sha1 in todo])
+        finally:
+            workers.close()
+            workers.join()
+
+        ret = []
+        errors = []
+        dirty = False
+        for (fname, sha1), text in zip(todo, texts):
+            name = None
+            num = None
+            for line in text.split("\n"):
+                if not name and "through" in line:
+                    name = '_'.join(str(dates.parse(line.split("through")[1])).split('-')[0:2])
+                if num == None and "Account Number:" in line:
+                    num = Decimal(line.split("Account Number:")[1].strip())
+            if account_num != None and num != account_num:
+                log.debug("%s is for account %s, not %s, leaving it alone" % (fname, num, self.name))
+                continue
+            if not name or len(name) != 7:
+                errors.append("Can't get date of Statement pdf file %s for rename (got %s)" % (fname, name))
+                continue
+            dest = os.path.join(self.statements_dir, name + ".pdf")
+            if os.path.exists(dest):
+                if file_hash(dest) != sha1:
+                    errors.append("Can't take in %s: %s already exists" % (fname, dest))
+                    continue
+                log.info("Already have %s as %s, leaving it alone" % (fname, dest))
+                manifest[sha1] = name + ".pdf"
+                dirty = True
+                continue
+            atomic_write(os.path.join(self.statements_dir, name + ".txt"), text)
+            atomic_move(fname, dest)
+            manifest[sha1] = name + ".pdf"
+            dirty = True
+            ret.append(dest)
+            log.info("Took in %s as %s" % (fname, dest))
+
+        if dirty:
+            atomic_write(manifest_fname, json.dumps(manifest, indent=4, sort_keys=True))
+        if errors:
+            raise ParseError("\n".join(errors))
+        return ret
 
     def load_from_statements(self):
         """Pull all transactions from the PDF statements, sort them by
         date.
 
+        Statements are extracted and parsed on a pool of up to
+        statement-workers processes (default: one per cpu), then put
+        back in date order. If any of them fail to parse, we raise one
+        ParseError listing every failure rather than stopping at the
+        first.
+
         """
-        for fname in sorted(glob.glob(os.path.join(self.statements_dir, "20??_??.pdf"))):
-            statement = Statement(fname, self.ledger_account)
-            statement.parse()
+        use_cache = c.get('statement-cache', True)
+        jobs = [(fname, self.ledger_account, use_cache)
+                for fname in sorted(glob.glob(os.path.join(self.statements_dir, "20??_??.pdf")))]
+        workers = min(len(jobs), c.get('statement-workers', multiprocessing.cpu_count()))
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(parse_statement, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [parse_statement(job) for job in jobs]
+
+        errors = [error for (statement, error) in results if error]
+        if errors:
+            raise ParseError("Couldn't parse %d of %d statements:\n%s" % (len(errors), len(jobs), "\n".join(errors)))
+        for (statement, error) in results:
             self.extend(statement.get_txs())
             self.statements.append(statement)
         self.account_num = self.statements[0]['account_num']
@@ -330,6 +498,39 @@ class Account(Transactions):
         # save a copy of this bank statement as a ledger file
         #self.write(os.path.join(os.path.split(c['ledger-file'])[0], (self.bank_name + "-" + self.name).replace(' ','_')+".ledger"))
 
+def extract_pdf(fname):
+    """Return the text of a PDF, laid out the way our parsers expect."""
+    return subprocess.check_output(["pdftotext", "-layout", fname, "-"])
+
+def atomic_write(fname, text):
+    """Write text to a temp file next to fname, then rename it over fname."""
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(fname) or ".", suffix=".tmp")
+    with os.fdopen(fd, 'w') as OUTF:
+        OUTF.write(text)
+    os.rename(temp, fname)
+
+def atomic_move(fname, dest):
+    """Move fname to dest such that dest is either absent or complete,
+    even if they're on different filesystems."""
+    try:
+        os.rename(fname, dest)
+    except OSError:
+        (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(dest) or ".", suffix=".tmp")
+        os.close(fd)
+        shutil.copy2(fname, temp)
+        os.rename(temp, dest)
+        os.remove(fname)
+
+def parse_statement(job):
+    """Worker for Account.load_from_statements. job is (fname,
+    ledger_account, use_cache). Returns (statement, None) or, if the
+    statement won't parse, (None, error message)."""
+    (fname, ledger_account, use_cache) = job
+    try:
+        return (load_statement(fname, ledger_account, Cache("statements") if use_cache else None), None)
+    except ParseError as e:
+        return (None, "%s: %s" % (fname, e.message))
+
 class Bank(dict):
     anvil_type = 'bank'
 
@@ -345,6 +546,7 @@ class Chase(Bank):
             account['name'] = account_name
             account['bank-name'] = self.name
             self[account_name] = (Account(**account))
+            self[account_name].intake()
             self[account_name].load_from_statements()
     def __str__(self):
         return self.name
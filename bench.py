@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""Timing checks for the slow paths in anvil. These aren't tests; run
+them by hand when changing one of the parsers and make sure the times
+grow linearly with the input:
+
+    ./bench.py chase [n]
+    ./bench.py reconcile [n]
+    ./bench.py records [n]
+    ./bench.py money [n]
+    ./bench.py write [n]
+    ./bench.py journal [n]
+
+"""
+import os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "banks"))
+
+def timed(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return (time.time() - start, ret)
+
+def report(name, sizes, times):
+    print name
+    for (n, t) in zip(sizes, times):
+        print "  %8d %8.3fs %8.2fus/item" % (n, t, t / n * 1e6)
+
+def chase_statement(n):
+    """Return the text of a Chase statement with n deposits, n checks and
+    n card purchases that adds up."""
+    deposits = "\n".join(["01/%02d       Deposit %d                                                       1,000.00" % (i % 28 + 1, i)
+                          for i in range(n)])
+    checks = "\n".join(["%d ^                                                           01/%02d          $10.00" % (1000 + i, i % 28 + 1)
+                        for i in range(n)])
+    purchases = "\n".join(["01/%02d       Card Purchase     01/%02d Hardware Store Brooklyn NY Card 2238       5.00" % (i % 28 + 1, i % 28 + 1)
+                           for i in range(n)])
+    balances = "\n".join(["01/%02d             1,000.00" % (i + 1) for i in range(28)])
+    ending = 1000 + n * (1000 - 10 - 5)
+    return """January 01, 2015 through January 30, 2015
+                                                              Account Number:             000000123456789
+
+ CHECKING SUMMARY                Chase Performance Business Checking
+                                                   INSTANCES              AMOUNT
+ Beginning Balance                                                    $1,000.00
+ Deposits and Additions                                    %(n)d          %(deposits)s
+ Checks Paid                                               %(n)d           -%(checks)s
+ ATM & Debit Card Withdrawals                              %(n)d            -%(purchases)s
+ Ending Balance                                            %(n)d          $%(ending)s
+
+DEPOSITS AND ADDITIONS
+DATE        DESCRIPTION                                                       AMOUNT
+%(deposit_lines)s
+Total Deposits and Additions                                           $%(deposits)s
+
+CHECKS PAID
+CHECK NO.      DESCRIPTION                                   DATE PAID           AMOUNT
+%(check_lines)s
+Total Checks Paid                                                              $%(checks)s
+
+ATM & DEBIT CARD WITHDRAWALS
+DATE        DESCRIPTION                                                       AMOUNT
+%(purchase_lines)s
+Total ATM & Debit Card Withdrawals                                            $%(purchases)s
+
+DAILY ENDING BALANCE
+DATE                  AMOUNT
+%(balance_lines)s
+
+SERVICE CHARGE SUMMARY
+""" % {'n':n, 'deposits':n * 1000, 'checks':n * 10, 'purchases':n * 5, 'ending':ending,
+       'deposit_lines':deposits, 'check_lines':checks, 'purchase_lines':purchases,
+       'balance_lines':balances}
+
+def bench_chase(n=1000):
+    """Parse synthetic statements of n, 2n, 4n and 8n transactions per section."""
+    import chase
+    directory = tempfile.mkdtemp()
+    try:
+        sizes = [n, 2*n, 4*n, 8*n]
+        times = []
+        for size in sizes:
+            fname = os.path.join(directory, "2015_01_%d.pdf" % size)
+            with open(os.path.splitext(fname)[0] + ".txt", 'w') as OUTF:
+                OUTF.write(chase_statement(size))
+            statement = chase.Statement(fname, "Assets:Checking")
+            (t, ret) = timed(statement.parse)
+            assert len(statement.get_txs()) == 3 * size
+            times.append(t)
+        report("Statement.parse", [3 * s for s in sizes], times)
+    finally:
+        shutil.rmtree(directory)
+
+def checking_txs(n, seed=0):
+    """Return n cleared Transactions touching Assets:Checking, a few a day."""
+    import datetime, random
+    import money
+    from transactions import Posting, Transaction, Transactions
+    rand = random.Random(seed)
+    txs = Transactions()
+    start = datetime.datetime(2000, 1, 1)
+    for i in range(n):
+        amount = money.parse("%d.%02d" % divmod(rand.randint(1, 100000), 100))
+        tx = Transaction(date=start + datetime.timedelta(days=i // 10), state="cleared", payee="Payee %d" % i)
+        tx['postings'] = [Posting(account_name="Assets:Checking", amount=-amount, tx=tx),
+                          Posting(account_name="Expenses:Misc", amount=amount, tx=tx)]
+        txs.append(tx)
+    return txs
+
+def checking_reconciler(n):
+    """Return a Reconciler for a ledger of n txs against a bank account
+    where every tenth tx is off by a cent."""
+    import money
+    from config import config as c
+    from accountant import Reconciler
+    (bank_name, bank) = c['banks'].items()[0]
+    ledger = checking_txs(n)
+    account = checking_txs(n)
+    account.bank_name = bank_name
+    account.name = bank['accounts'].keys()[0]
+    for tx in account[::10]:
+        tx['postings'][0]['amount'] -= money.parse("0.01")
+    return Reconciler(ledger, account)
+
+def bench_reconcile(n=100000):
+    """Match a ledger of n txs against a bank account where every tenth tx
+    is off by a cent, then walk the rows."""
+    reconciler = checking_reconciler(n)
+    (t_match, result) = timed(reconciler.match)
+    (t_rows, rows) = timed(lambda: len(list(reconciler.rows(result))))
+    print "Reconciler on %d txs a side: match %.2fs, rows %.2fs (%d rows, %d matched)" % (
+        n, t_match, t_rows, rows, len(result.matched))
+
+def bench_records(n=200000):
+    """Memory for n two-posting transactions, and the time to read a
+    field from each of them by key and (if supported) by attribute."""
+    import resource
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    (t_build, txs) = timed(checking_txs, n)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    print "%d txs: built in %.2fs, %.0f MB (%.0f bytes/tx)" % (n, t_build, rss / 1024.0, rss * 1024.0 / n)
+    def by_key():
+        for tx in txs:
+            tx['date']
+            for p in tx['postings']:
+                p['account_name']
+    def by_attr():
+        for tx in txs:
+            tx.date
+            for p in tx.postings:
+                p.account_name
+    print "  by key:  %.3fs" % timed(by_key)[0]
+    if hasattr(txs[0], 'date'):
+        print "  by attr: %.3fs" % timed(by_attr)[0]
+
+def bench_money(n=100000):
+    """Sums and matching over n txs with Decimal amounts and with
+    integer cents."""
+    import datetime, money
+    from accountant import Monthly_Balancer
+    cutoffs = [datetime.datetime(2000 + y, m, 1) for y in range(n // 3650 + 1) for m in range(1, 13)]
+    for cents in [False, True]:
+        money.cents = cents
+        txs = checking_txs(n)
+        def total():
+            return sum([p.amount for tx in txs for p in tx.postings if p.account_name == "Assets:Checking"])
+        (t_sum, amount) = timed(total)
+        # a plain list has no columnar view, so this is the python sweep
+        (t_bal, balances) = timed(Monthly_Balancer().balances, list(txs), "Assets:Checking", cutoffs)
+        reconciler = checking_reconciler(n)
+        (t_match, result) = timed(reconciler.match)
+        print "%-13s sum %.2fs (%s), balances %.2fs, match %.2fs (%d matched)" % (
+            "integer cents" if cents else "Decimal", t_sum, money.to_decimal(amount), t_bal, t_match, len(result.matched))
+
+def bench_write(n=200000):
+    """Time writing a journal of n txs, and the memory it takes on top
+    of the txs themselves."""
+    import resource
+    txs = checking_txs(n)
+    (fd, fname) = tempfile.mkstemp(suffix=".ledger")
+    os.close(fd)
+    try:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        (t, ret) = timed(txs.write, fname)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+        print "wrote %d txs (%.0f MB) in %.2fs, %.0f MB extra" % (
+            n, os.path.getsize(fname) / 1048576.0, t, rss / 1024.0)
+    finally:
+        os.remove(fname)
+
+def bench_journal(n=20000):
+    """Load journals of n, 2n and 4n txs with the native parser and
+    through ledger's xml, uncached. The xml side needs ledger on
+    PATH."""
+    from distutils.spawn import find_executable
+    from ledger import Ledger
+    parsers = ["native", "xml"] if find_executable("ledger") else ["native"]
+    if len(parsers) == 1:
+        print "ledger isn't on PATH, so only timing the native parser"
+    directory = tempfile.mkdtemp()
+    try:
+        sizes = [n, 2*n, 4*n]
+        times = dict((parser, []) for parser in parsers)
+        for size in sizes:
+            fname = os.path.join(directory, "bench-%d.ledger" % size)
+            checking_txs(size).write(fname)
+            for parser in parsers:
+                ledger = Ledger(fname, parser=parser, cache=False)
+                (t, ret) = timed(ledger.load)
+                assert len(ledger) == size
+                times[parser].append(t)
+        for parser in parsers:
+            report("Ledger.load, %s parser" % parser, sizes, times[parser])
+    finally:
+        shutil.rmtree(directory)
+
+benches = {'chase':bench_chase, 'reconcile':bench_reconcile, 'records':bench_records, 'money':bench_money,
+           'write':bench_write, 'journal':bench_journal}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benches:
+        sys.stderr.write("Usage: %s [%s] [n]\n" % (sys.argv[0], "|".join(sorted(benches))))
+        sys.exit(1)
+    benches[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
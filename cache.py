@@ -0,0 +1,136 @@
+"""An on-disk cache for things that are slow to parse but only change
+when the file they came from changes, e.g. the transactions ledger
+gives us for each journal file.
+
+Each Cache is a directory under cache-dir (from config.json, default
+~/.cache/anvil) holding one pickle per entry. An entry remembers the
+mtime, size and sha1 of the source file it was made from. If mtime
+and size still match, we trust it. If they don't, we hash the file
+and only throw the entry away if the content actually changed.
+
+"""
+import cPickle as pickle
+import hashlib, os, tempfile, time
+
+from config import config as c
+import money
+from namespace import Namespace
+
+from logger import logger
+log = logger.get_logger()
+
+def file_hash(fname):
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as INF:
+        for chunk in iter(lambda: INF.read(1 << 20), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class Cache(object):
+    # Bump this whenever the pickled classes change shape
+    version = 4
+
+    def __init__(self, name, directory=None):
+        if not directory:
+            directory = c.get('cache-dir', '~/.cache/anvil')
+        self.name = name
+        self.dir = os.path.join(os.path.expanduser(directory), name)
+
+    @classmethod
+    def names(cls, directory=None):
+        """Return the names of all the caches that exist on disk."""
+        if not directory:
+            directory = c.get('cache-dir', '~/.cache/anvil')
+        directory = os.path.expanduser(directory)
+        if not os.path.isdir(directory):
+            return []
+        return sorted([d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d))])
+
+    def path(self, key):
+        return os.path.join(self.dir, hashlib.sha1(repr(key)).hexdigest() + ".pickle")
+
+    def stamp(self, source):
+        """Describe source as it is right now. Take the stamp *before*
+        parsing source so a change made while we parse invalidates the
+        entry."""
+        st = os.stat(source)
+        return {'source':source, 'mtime':st.st_mtime, 'size':st.st_size, 'sha1':file_hash(source)}
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as INF:
+                entry = pickle.load(INF)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+            return None
+        if entry.get('version') != self.version:
+            return None
+        if entry.get('cents', False) != money.cents:
+            # amounts pickled as the wrong kind (see money.py)
+            return None
+        return entry
+
+    def write(self, path, entry):
+        """Write to a temp file and rename it into place so a crash can't
+        leave half an entry behind."""
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        (fd, temp) = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as OUTF:
+            pickle.dump(entry, OUTF, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, path)
+
+    def get(self, key, source):
+        """Return the value stored under key if source hasn't changed
+        since it was stored, else None."""
+        path = self.path(key)
+        entry = self.read(path)
+        if not entry or entry['key'] != key:
+            return None
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        if (entry['mtime'], entry['size']) == (st.st_mtime, st.st_size):
+            return entry['value']
+        if entry['sha1'] == file_hash(source):
+            # touched but not changed
+            entry['mtime'] = st.st_mtime
+            entry['size'] = st.st_size
+            self.write(path, entry)
+            return entry['value']
+        return None
+
+    def put(self, key, stamp, value):
+        entry = {'version':self.version, 'cents':money.cents, 'key':key, 'value':value}
+        entry.update(stamp)
+        try:
+            self.write(self.path(key), entry)
+        except (IOError, OSError) as e:
+            log.debug("Couldn't write {0} cache entry for {1}: {2}".format(self.name, key, e))
+
+    def entries(self):
+        """Yield a Namespace describing each entry in this cache."""
+        if not os.path.isdir(self.dir):
+            return
+        for fname in sorted(os.listdir(self.dir)):
+            if not fname.endswith(".pickle"):
+                continue
+            path = os.path.join(self.dir, fname)
+            entry = self.read(path)
+            yield Namespace({'cache':self.name,
+                             'source':entry.get('source', "") if entry else "(stale)",
+                             'sha1':entry['sha1'] if entry else "",
+                             'key':entry['key'] if entry else None,
+                             'bytes':os.path.getsize(path),
+                             'stored':time.strftime("%Y/%m/%d %H:%M", time.localtime(os.path.getmtime(path)))})
+
+    def purge(self):
+        """Delete every entry in this cache. Return how many we deleted."""
+        if not os.path.isdir(self.dir):
+            return 0
+        count = 0
+        for fname in os.listdir(self.dir):
+            if fname.endswith(".pickle") or fname.endswith(".tmp"):
+                os.remove(os.path.join(self.dir, fname))
+                count += 1
+        return count
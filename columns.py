@@ -0,0 +1,152 @@
+"""A columnar view of a Transactions list for bulk queries.
+
+Each posting becomes one row of a set of NumPy arrays: the index of
+its transaction in the list, the day ordinals of the transaction's
+date and of the posting's effective (aux) date, the amount in integer
+cents, and integer codes for the account name and the cleared state.
+Sums, date ranges and group-bys are then vectorized instead of walking
+Python objects and Decimals. Sums come back as amounts (see money.py).
+
+NumPy is optional. If it isn't installed, `available` is False and
+Transactions.columns() returns None, so callers fall back to walking
+the transactions themselves.
+
+The one caller is Monthly_Balancer.balances, whose month-end sweep is
+the bulk query this was built for. Transactions.sum() goes through the
+account trie and Reconciler works on the records, so neither uses the
+view. balances() only trusts the view when it is exact, so its answer
+is the same as the record walk's, in Decimals or in cents.
+
+The view is a snapshot. Transactions drops it when the list changes
+or a posting's amount or account is edited, but if you edit anything
+else in place (e.g. a date), call Transactions.changed().
+
+"""
+import datetime
+from collections import OrderedDict
+from money import to_cents, from_cents
+
+try:
+    import numpy
+    available = True
+except ImportError:
+    numpy = None
+    available = False
+
+# datetime64[D] counts days from 1970/01/01, date.toordinal() from 0001/01/01
+epoch = datetime.date(1970, 1, 1).toordinal()
+
+states = {"":0, "cleared":1, "pending":2}
+
+class Columns(object):
+    """Build the view of txs (a list of Transactions). Amounts that
+    aren't a whole number of cents can't be represented. If there are
+    any, exact is False and callers shouldn't trust the sums."""
+    def __init__(self, txs):
+        self.accounts = [] # code -> account name
+        codes = {}
+        tx_idx = []
+        day = []
+        aux_day = []
+        cents = []
+        account = []
+        state = []
+        self.exact = True
+        for idx, tx in enumerate(txs):
+            tx_day = tx.date.toordinal()
+            tx_aux_day = tx.aux_date.toordinal() if tx.aux_date else tx_day
+            tx_cleared = tx.state == "cleared"
+            for p in tx.postings:
+                tx_idx.append(idx)
+                day.append(tx_day)
+                aux_day.append(p.aux_date.toordinal() if p.aux_date else tx_aux_day)
+                if p.amount:
+                    (amount, exact) = to_cents(p.amount)
+                    if not exact:
+                        self.exact = False
+                    cents.append(amount)
+                else:
+                    cents.append(0)
+                name = p.account_name
+                if not name in codes:
+                    codes[name] = len(self.accounts)
+                    self.accounts.append(name)
+                account.append(codes[name])
+                state.append(states["cleared"] if tx_cleared else states.get(p.state, 0))
+        self.tx_idx = numpy.array(tx_idx, dtype=numpy.int64)
+        self.day = numpy.array(day, dtype=numpy.int32)
+        self.aux_day = numpy.array(aux_day, dtype=numpy.int32)
+        self.cents = numpy.array(cents, dtype=numpy.int64)
+        self.account = numpy.array(account, dtype=numpy.int32)
+        self.state = numpy.array(state, dtype=numpy.int8)
+
+    def __len__(self):
+        return len(self.cents)
+
+    def account_codes(self, match):
+        """Return the codes of the accounts for which match(name) is true."""
+        return numpy.array([code for code, name in enumerate(self.accounts) if match(name)], dtype=numpy.int32)
+
+    def accounts_under(self, prefix):
+        """Mask of the postings to accounts that start with prefix, ignoring case."""
+        prefix = prefix.lower()
+        return numpy.in1d(self.account, self.account_codes(lambda name: name.lower().startswith(prefix)))
+
+    def accounts_matching(self, pat):
+        """Mask of the postings to accounts pat (a compiled regex) finds."""
+        return numpy.in1d(self.account, self.account_codes(lambda name: pat.search(name)))
+
+    def cleared(self):
+        """Mask of the postings that are cleared, or whose tx is."""
+        return self.state == states["cleared"]
+
+    def between(self, start=None, end=None, effective=False):
+        """Mask of the postings dated on or after start and before end
+        (dates or datetimes, either can be None). With effective, use
+        aux dates."""
+        days = self.aux_day if effective else self.day
+        mask = numpy.ones(len(days), dtype=bool)
+        if start:
+            mask &= days >= start.toordinal()
+        if end:
+            mask &= days < end.toordinal()
+        return mask
+
+    def sum(self, mask=None):
+        return from_cents(self.cents.sum() if mask is None else self.cents[mask].sum())
+
+    def by_account(self, mask=None):
+        """Return {account name: total} over the postings in mask."""
+        account = self.account if mask is None else self.account[mask]
+        cents = self.cents if mask is None else self.cents[mask]
+        totals = numpy.zeros(len(self.accounts), dtype=numpy.int64)
+        numpy.add.at(totals, account, cents)
+        present = numpy.zeros(len(self.accounts), dtype=bool)
+        present[account] = True
+        return dict([(self.accounts[code], from_cents(totals[code])) for code in numpy.flatnonzero(present)])
+
+    def by_month(self, mask=None, effective=False):
+        """Return an OrderedDict of (year, month): total over the postings
+        in mask, in date order."""
+        days = self.aux_day if effective else self.day
+        if mask is not None:
+            days = days[mask]
+        cents = self.cents if mask is None else self.cents[mask]
+        months = (days - epoch).astype('datetime64[D]').astype('datetime64[M]').astype(numpy.int64)
+        (keys, inverse) = numpy.unique(months, return_inverse=True)
+        totals = numpy.zeros(len(keys), dtype=numpy.int64)
+        numpy.add.at(totals, inverse, cents)
+        return OrderedDict([((1970 + key // 12, key % 12 + 1), from_cents(total)) for key, total in zip(keys, totals)])
+
+    def totals_before(self, cutoffs, mask=None, effective=False):
+        """Like util.totals_before: for each date in cutoffs, the total of
+        the postings in mask dated strictly before it."""
+        days = self.aux_day if effective else self.day
+        cents = self.cents
+        if mask is not None:
+            days = days[mask]
+            cents = cents[mask]
+        order = numpy.argsort(days, kind='mergesort')
+        running = numpy.concatenate([[0], numpy.cumsum(cents[order])])
+        idx = numpy.searchsorted(days[order], [cutoff.toordinal() for cutoff in cutoffs], side='left')
+        return [from_cents(running[i]) for i in idx]
@@ -0,0 +1,106 @@
+"""Date parsing shared by the ledger and statement parsers.
+
+Nearly every date we see is in one of a couple of fixed formats:
+ledger's --date-format %Y/%m/%d, or the MM/DD of a bank statement.
+Those get parsed with one regex. Anything else goes to
+dateutil.parser, which is slow but copes with "January 30, 2015".
+Results, failures included, are memoized, since statements repeat
+the same few dozen MM/DD strings over and over.
+
+parse() raises ValueError on text that isn't a date. try_parse()
+returns None instead. valid() says whether parse() would work, without
+parsing the fixed formats. Both return what dateutil.parser.parse(text)
+would: missing fields (e.g. the year in 01/30) come from today.
+
+"""
+import datetime, re
+import dateutil.parser
+
+ymd_pat = re.compile(r"^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$")
+md_pat = re.compile(r"^(\d{1,2})/(\d{1,2})$")
+
+# The memo is two dicts. New results go in recent. When recent fills
+# up, it becomes older and we start a new recent, and anything found
+# in older moves back to recent. So the strings in use stay, the rest
+# age out, and a lookup is a dict lookup or two.
+memo_size = 4096
+recent = {}
+older = {}
+failed = object() # memoized "not a date"
+
+# days in each month, with February's from a leap year (see valid)
+month_days = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+def fast_parse(text):
+    """Parse the fixed formats. Return None if text isn't one of them,
+    or is ambiguous (a month over 12, which dateutil would read as a
+    day), so the caller can ask dateutil."""
+    m = ymd_pat.match(text)
+    if m:
+        (year, month, day) = m.groups()
+    else:
+        m = md_pat.match(text)
+        if not m:
+            return None
+        (month, day) = m.groups()
+        year = datetime.date.today().year
+    if int(month) > 12:
+        return None
+    return datetime.datetime(int(year), int(month), int(day))
+
+def try_parse(text):
+    """Return text as a datetime, or None if it isn't a date."""
+    global recent, older
+    try:
+        date = recent[text]
+    except KeyError:
+        if text in older:
+            date = older[text]
+        else:
+            try:
+                date = fast_parse(text)
+                if date is None:
+                    date = dateutil.parser.parse(text)
+            except (TypeError, ValueError, OverflowError):
+                date = failed
+        if len(recent) >= memo_size:
+            (recent, older) = ({}, recent)
+        recent[text] = date
+    return None if date is failed else date
+
+def parse(text):
+    date = try_parse(text)
+    if date is None:
+        raise ValueError("Can't parse date: %s" % text)
+    return date
+
+def valid(text):
+    """True if parse(text) would work. For the fixed formats we only
+    check that the fields are in range, which is cheaper than
+    building the datetime."""
+    m = ymd_pat.match(text) or md_pat.match(text)
+    if m:
+        fields = [int(field) for field in m.groups()]
+        (month, day) = fields[-2:]
+        if not 0 in fields and month <= 12 and day <= month_days[month - 1] and (month, day) != (2, 29):
+            return True
+    return try_parse(text) is not None
+
+def lazy(slot):
+    """Return a property that keeps a date in slot as the string it was
+    read as, and only parses it the first time somebody asks. For
+    fields like aux dates that we read far more often than we use.
+
+    A string that isn't a date raises ValueError when it's set, so
+    bad dates still get caught where they're read in."""
+    def get(self):
+        val = getattr(self, slot)
+        if isinstance(val, basestring):
+            val = parse(val)
+            setattr(self, slot, val)
+        return val
+    def set(self, val):
+        if isinstance(val, basestring) and not valid(val):
+            raise ValueError("Can't parse date: %s" % val)
+        setattr(self, slot, val)
+    return property(get, set)
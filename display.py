@@ -1,4 +1,6 @@
 #from errs import UnimplementedError
+import sys
+from money import to_decimal
 from namespace import Namespace
 
 class Display():
@@ -15,10 +17,15 @@ class Display():
 
     output_file = "-" # stdout. Set to something else for something else.
 
+    # Amounts might be ints counting cents (see money.py). Displays
+    # should print to_decimal(amount), not the amount.
+    to_decimal = staticmethod(to_decimal)
+
 class Monthly_Bal(Display):
     months = []
     def add(self, end_date, statement_bal, ledger_bal, last_month):
-        self.months.append(Namespace({'end_date':end_date, 'statement_bal':statement_bal, 'ledger_bal':ledger_bal, 'last_month':last_month}))
+        self.months.append(Namespace({'end_date':end_date, 'statement_bal':to_decimal(statement_bal),
+                                      'ledger_bal':to_decimal(ledger_bal), 'last_month':to_decimal(last_month)}))
 
 
     def done(self, first_continuous):
@@ -40,3 +47,63 @@ class Monthly_Bal(Display):
         them, as they aren't errors that affect the final totals.
         """
         raise NotImplementedError, "Monthly_Bal not implemented for this interface."""
+
+class Cache(Display):
+    def __init__(self):
+        self.entries = []
+    def add(self, entry):
+        """entry is a Namespace with cache, source (the file it came
+        from), sha1 (of that file), bytes and stored fields."""
+        self.entries.append(entry)
+
+    def done(self, purged=False):
+        """Called once every cache entry has been added. If purged is
+        True, the entries listed have just been deleted."""
+        raise NotImplementedError, "Cache not implemented for this interface."
+
+class Reconcile(Display):
+    """Reconcile output gets written as it is computed rather than
+    held until done(), so a big account doesn't have to fit in memory
+    as one report and you see rows as soon as they're ready.
+
+    One Reconcile handles every account a command reconciles: start(),
+    add() for each row, and done() once per account, then close() once
+    at the end. The output is opened when the first account starts."""
+    out = None
+
+    def open(self):
+        """Called once, before the first account starts."""
+        if self.output_file == "-":
+            self.out = sys.stdout
+        else:
+            self.out = open(self.output_file, 'w')
+
+    def start(self, ledger_account):
+        """Called before the first row of each account. ledger_account
+        is the ledger account being reconciled, e.g. Assets:Checking."""
+        self.ledger_account = ledger_account
+        if self.out is None:
+            self.open()
+
+    def add(self, row):
+        """row is a Namespace with date, ledger (the ledger tx or None),
+        account (the bank tx or None), and ledger_total and
+        account_total, the running totals of each side so far."""
+        raise NotImplementedError, "Reconcile not implemented for this interface."
+
+    def status(self, row):
+        if row.ledger and row.account:
+            return "matched"
+        if row.ledger:
+            return "ledger only"
+        return "bank only"
+
+    def done(self, result):
+        """Called after the last row of each account. result is what
+        Reconciler.match() returned."""
+        pass
+
+    def close(self):
+        """Called once, after the last account."""
+        if self.out is not None and self.out is not sys.stdout:
+            self.out.close()
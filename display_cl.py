@@ -72,3 +72,44 @@ class Monthly_Bal(display.Monthly_Bal):
             with open(self.output_file, 'w') as OUTF:
                 OUTF.write(out)
 
+class Cache(display.Cache):
+    def done(self, purged=False):
+        """Print a table of cache entries, or note that there aren't any."""
+        if not self.entries:
+            out = "The cache is empty."
+        else:
+            cols = ["Cache", "Source", "SHA1", "Bytes", "Stored"]
+            rows = [[e.cache, e.source, e.sha1, str(e.bytes), e.stored] for e in self.entries]
+            widths = [max([len(cols[idx])] + [len(row[idx]) for row in rows]) for idx in range(0,5)]
+            fmtstr = "|" + "".join(["{%d:<%d}|" % (idx, widths[idx]) for idx in range(0,5)])
+            out = fmtstr.format(*cols) + "\n"
+            for row in rows:
+                out += fmtstr.format(*row) + "\n"
+            out += "%d entries, %d bytes" % (len(rows), sum([e.bytes for e in self.entries]))
+            if purged:
+                out += " purged"
+        if self.output_file == "-":
+            print out
+        else:
+            with open(self.output_file, 'w') as OUTF:
+                OUTF.write(out)
+
+class Reconcile(display.Reconcile):
+    def start(self, ledger_account):
+        display.Reconcile.start(self, ledger_account)
+        self.out.write("Reconciling %s\n\n" % ledger_account.encode('utf-8'))
+
+    def add(self, row):
+        """Print the row's date, status and running totals (starred if
+        they disagree), then the ledger tx (L) and bank tx (B)."""
+        out = u"{0}  {1:<11}  ledger {2:>12}  bank {3:>12}{4}\n".format(
+            row.date.strftime("%Y/%m/%d"), self.status(row), self.to_decimal(row.ledger_total), self.to_decimal(row.account_total),
+            "" if row.ledger_total == row.account_total else "  *")
+        for label, tx in [("L", row.ledger), ("B", row.account)]:
+            if tx:
+                out += "".join([u"  %s %s\n" % (label, line) for line in unicode(tx).rstrip("\n").split("\n")])
+        self.out.write((out + "\n").encode('utf-8'))
+
+    def done(self, result):
+        self.out.write("%d matched, %d only in the ledger, %d only at the bank, %d uncleared\n" %
+                       (len(result.matched), len(result.ledger), len(result.account), len(result.uncleared)))
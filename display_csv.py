@@ -48,3 +48,38 @@ class Monthly_Bal(display.Monthly_Bal):
                 OUTF.write(csvfile.getvalue())
         csvfile.close()
 
+class Cache(display.Cache):
+    def done(self, purged=False):
+        """Output one row per cache entry in excel csv format."""
+        csvfile = StringIO.StringIO()
+        csvwriter = csv.writer(csvfile, dialect=csv.excel)
+        csvwriter.writerow(["Cache", "Source", "SHA1", "Bytes", "Stored", "Purged"])
+        for e in self.entries:
+            csvwriter.writerow([e.cache, e.source, e.sha1, e.bytes, e.stored, purged])
+
+        if self.output_file == "-":
+            print csvfile.getvalue()
+        else:
+            with open(self.output_file, 'w') as OUTF:
+                OUTF.write(csvfile.getvalue())
+        csvfile.close()
+
+class Reconcile(display.Reconcile):
+    """Output one row per reconcile row in excel csv format, every
+    account in one table."""
+    def open(self):
+        display.Reconcile.open(self)
+        self.csvwriter = csv.writer(self.out, dialect=csv.excel)
+        self.csvwriter.writerow(["Account", "Date", "Status", "Ledger Payee", "Ledger Amount", "Bank Payee", "Bank Amount",
+                                 "Ledger Total", "Bank Total"])
+
+    def add(self, row):
+        cols = [self.ledger_account.encode('utf-8'), row.date.strftime("%Y/%m/%d"), self.status(row)]
+        for tx in [row.ledger, row.account]:
+            if tx:
+                amount = sum([p['amount'] for p in tx['postings'] if p['account_name'].lower().startswith(self.ledger_account.lower())])
+                cols.extend([tx['payee'].encode('utf-8'), "$%s" % self.to_decimal(amount)])
+            else:
+                cols.extend(["", ""])
+        cols.extend(["$%s" % self.to_decimal(row.ledger_total), "$%s" % self.to_decimal(row.account_total)])
+        self.csvwriter.writerow(cols)
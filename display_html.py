@@ -0,0 +1,57 @@
+"""HTML display objects
+
+Only reconcile has an html display so far. The other commands fall
+back to their command line displays.
+
+"""
+
+import cgi
+import display
+from display_cl import Monthly_Bal, Cache
+
+class Reconcile(display.Reconcile):
+    """A two column table, ledger on the left and bank on the right, with
+    the running totals of each side after every row. Totals are green
+    when the two sides agree and blue after a matched pair that leaves
+    them disagreeing. Postings to the reconciled account are red."""
+    def open(self):
+        display.Reconcile.open(self)
+        self.out.write("<html><body>\n")
+
+    def start(self, ledger_account):
+        display.Reconcile.start(self, ledger_account)
+        self.out.write((u"<h2>{0}</h2>\n<table border='1'>\n".format(cgi.escape(ledger_account))).encode('utf-8'))
+
+    def cell(self, tx):
+        if not tx:
+            return ""
+        lines = []
+        for line in cgi.escape(unicode(tx)).split("\n"):
+            idx = line.find(self.ledger_account)
+            if idx != -1:
+                line = line[:idx] + "<font color='red'>" + line[idx:] + "</font>"
+            lines.append(line)
+        return "<br />\n".join(lines)
+
+    def add(self, row):
+        out = u"<tr><td align='right'>{0}</td><td>{1}</td></tr>\n".format(self.cell(row.ledger), self.cell(row.account))
+        if row.ledger_total == row.account_total:
+            color = "green"
+        elif row.ledger and row.account:
+            color = "blue"
+        else:
+            color = None
+        if color:
+            out += (u"<tr><td align='right'><font color='{2}'>{0}</font><br /></td><td><font color='{2}'>{1}</font></td></tr>\n".
+                    format(self.to_decimal(row.ledger_total), self.to_decimal(row.account_total), color))
+        else:
+            out += u"<tr><td align='right'>{0}<br /></td><td>{1}</td></tr>\n".format(self.to_decimal(row.ledger_total), self.to_decimal(row.account_total))
+        self.out.write(out.encode('utf-8'))
+
+    def done(self, result):
+        self.out.write("</table>\n")
+
+    def close(self):
+        if self.out is not None:
+            self.out.write("</body></html>\n")
+        display.Reconcile.close(self)
@@ -0,0 +1,263 @@
+"""A parser for the subset of the ledger journal format we actually
+use. It reads journal text straight into Transaction and Posting
+objects so Ledger.load doesn't have to round trip every file through
+`ledger xml`.
+
+What we handle: dates with =aux dates, state flags, codes, payee line
+and comment line notes, :tag: and key: value metadata, [=date] aux
+dates in posting notes, commodity amounts (e.g. $-1,234.56 or 10 USD)
+and a single elided amount per transaction. Periodic (~) transactions
+and comment blocks are skipped. Anything that would change what
+ledger reports (automated transactions, alias, apply, bucket) is
+refused with a ParseError so nobody gets silently wrong numbers. Use
+the xml parser for those journals.
+
+"""
+import dates, re
+
+from errs import ParseError
+from transactions import Transaction, Posting
+import money
+
+states = {"*":"cleared", "!":"pending"}
+
+date_sep_pat = re.compile(r"[/.-]")
+xact_pat = re.compile(r"^(?P<date>[\d/.-]+)(?:=(?P<aux>[\d/.-]+))?"
+                      r"(?:\s+(?P<state>[*!]))?"
+                      r"(?:\s+\((?P<code>[^)]*)\))?"
+                      r"(?:\s+(?P<payee>.*?))?"
+                      r"(?:(?:\t|  )\s*;(?P<note>.*))?$")
+post_pat = re.compile(r"^\s+(?:(?P<state>[*!])\s*)?"
+                      r"(?P<account>[^\s;](?:[^\t;]*?[^\s])??)"
+                      r"(?:(?:\t|  )\s*(?P<amount>[^;]*?))?"
+                      r"\s*(?:;(?P<note>.*))?$")
+amount_pat = re.compile(r"^(?P<neg>-)?(?P<prefix>[^\d\s.,+-][^\d\s.,+-]*)?(?P<sep>\s*)"
+                        r"(?P<sign>-)?(?P<qty>\d[\d,]*(?:\.\d+)?|\.\d+)"
+                        r"(?:(?P<sep2>\s*)(?P<suffix>[^\d\s.,+-][^\d\s.,+-]*))?$")
+tag_pat = re.compile(r"^:(?:[^:\s]+:)+$")
+date_note_pat = re.compile(r"\[(\d[\d/.-]*)?(?:=(\d[\d/.-]*))?\]")
+
+refused = ["=", "alias ", "apply ", "bucket ", "A "]
+
+def parse_date(text, year=None):
+    """Turn 2015/1/3, 2015-01-03 or (with a year directive) 1/3 into a datetime."""
+    parts = date_sep_pat.split(text.strip())
+    if len(parts) == 2 and year:
+        parts.insert(0, str(year))
+    if (not len(parts) in (2, 3) or [part for part in parts if not part.isdigit()]
+        or (len(parts) == 3 and len(parts[0]) != 4)):
+        raise ParseError("Can't parse date: %s" % text)
+    try:
+        return dates.parse("/".join(parts))
+    except ValueError:
+        raise ParseError("Can't parse date: %s" % text)
+
+def parse_amount(text):
+    """Return (commodity, flags, amount) for an amount like $-1,234.56
+    Price annotations (@ ...) and balance assertions (= ...) are dropped."""
+    text = re.split(r"\s[@=]|^[@=]|\{", text, 1)[0].strip()
+    m = amount_pat.match(text)
+    if not m:
+        raise ParseError("Can't parse amount: %s" % text)
+    d = m.groupdict()
+    amount = money.parse(d['qty'])
+    if d['neg'] or d['sign']:
+        amount = -amount
+    flags = ""
+    if d['prefix']:
+        commodity = d['prefix']
+        flags += "P"
+        if d['sep']: flags += "S"
+    else:
+        commodity = d['suffix'] or ""
+        if d['sep2']: flags += "S"
+    if "," in d['qty']:
+        flags += "T"
+    return (commodity, flags, amount)
+
+def parse_note_tags(note, item):
+    """Pull :tag: and key: value metadata out of a note into item['tags']
+    and [date=aux] dates into item['aux_date'] the way ledger does."""
+    m = date_note_pat.search(note)
+    if m and m.group(2) and 'aux_date' in item:
+        item['aux_date'] = parse_date(m.group(2))
+    if not 'tags' in item:
+        return
+    for line in note.split("\n"):
+        words = line.split()
+        for idx, word in enumerate(words):
+            if tag_pat.match(word):
+                for tag in word.strip(":").split(":"):
+                    item['tags'][tag] = None
+            elif idx == 0 and word.endswith(":") and len(word) > 1:
+                item['tags'][word[:-1]] = line.split(word,1)[1].strip()
+                break
+
+def append_note(item, text):
+    if item['note']:
+        item['note'] += "\n" + text
+    else:
+        item['note'] = text
+
+def finish(tx, fname):
+    """Fill in the elided amount, if any, and parse notes for metadata."""
+    elided = [p for p in tx['postings'] if p['amount'] == None]
+    if len(elided) > 1:
+        raise ParseError("Transaction on %s in %s has more than one posting without an amount" % (tx.get_date(), fname))
+    if elided:
+        others = [p for p in tx['postings'] if p['amount'] != None]
+        if len(set(p['commodity'] for p in others)) > 1:
+            raise ParseError("Can't infer the missing amount of a multi-commodity transaction on %s in %s" % (tx.get_date(), fname))
+        elided[0]['amount'] = -sum(p['amount'] for p in others)
+        if others:
+            elided[0]['commodity'] = others[0]['commodity']
+            elided[0]['commodity_flags'] = others[0]['commodity_flags']
+    if tx['note']:
+        parse_note_tags(tx['note'], tx)
+    for p in tx['postings']:
+        if p['note']:
+            parse_note_tags(p['note'], p)
+
+def parse(lines, fname=None):
+    """Parse a list of journal lines (include lines already removed) and
+    yield Transactions as each one is finished. Lines that are byte
+    strings get decoded as UTF-8, so text fields come back unicode like
+    they do from the xml parser."""
+    tx = None
+    post = None
+    year = None
+    in_block = False
+    for line_no, line in enumerate(lines):
+        if isinstance(line, str):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                raise ParseError("Line %d of %s isn't UTF-8: %r" % (line_no+1, fname, line))
+        line = line.rstrip("\r")
+        if in_block:
+            if line.strip() in ("end comment", "end test"):
+                in_block = False
+            continue
+        if not line.strip():
+            if tx:
+                finish(tx, fname)
+                yield tx
+            tx = post = None
+            continue
+        if line[0] in " \t":
+            if not tx: # postings of a skipped periodic tx, or stray whitespace
+                continue
+            stripped = line.strip()
+            if stripped[0] in ";#%|":
+                append_note(post if post else tx, stripped[1:].rstrip())
+                continue
+            m = post_pat.match(line)
+            if not m:
+                raise ParseError("Can't parse posting at line %d of %s: %s" % (line_no+1, fname, line))
+            d = m.groupdict()
+            account = d['account'].strip()
+            if account[0] in "[(" and account[-1] in "])":
+                account = account[1:-1]
+            post = Posting(account_name=account, state=states.get(d['state'], ""),
+                           note=(d['note'] or "").rstrip(), tx=tx)
+            if d['amount']:
+                (post['commodity'], post['commodity_flags'], post['amount']) = parse_amount(d['amount'])
+            tx['postings'].append(post)
+            continue
+
+        # Not indented, so this ends any tx in progress
+        if tx:
+            finish(tx, fname)
+            yield tx
+        tx = post = None
+        if line[0].isdigit():
+            m = xact_pat.match(line)
+            if not m:
+                raise ParseError("Can't parse transaction at line %d of %s: %s" % (line_no+1, fname, line))
+            d = m.groupdict()
+            tx = Transaction(fname=fname,
+                             date=parse_date(d['date'], year),
+                             state=states.get(d['state'], ""),
+                             code=d['code'] or "",
+                             payee=(d['payee'] or "").strip() or "PAYEE UNKNOWN",
+                             note=(d['note'] or "").rstrip())
+            if d['aux']:
+                tx['aux_date'] = parse_date(d['aux'], year)
+        elif line.split()[0] in ("year", "Y"):
+            year = int(line.split()[1])
+        elif line.strip() in ("comment", "test"):
+            in_block = True
+        else:
+            for directive in refused:
+                if line.startswith(directive):
+                    raise ParseError("The native parser doesn't handle '%s' (line %d of %s). Use the xml parser." % (line.strip(), line_no+1, fname))
+    if tx:
+        finish(tx, fname)
+        yield tx
+
+def supported(search, opts):
+    """True if we can reproduce what ledger would select for search and opts.
+
+    We understand account regexes in search and --related-all, -b and
+    -e in opts (plus the --date-format we pass ourselves).
+
+    """
+    for term in search.split():
+        if term in ("and", "or", "not", "expr") or term[0] in "@%=/(!&|":
+            return False
+    words = opts.split()
+    idx = 0
+    while idx < len(words):
+        if words[idx] in ("-b", "--begin", "-e", "--end", "--date-format"):
+            idx += 2
+            continue
+        if words[idx] not in ("--related-all",):
+            return False
+        idx += 1
+    return True
+
+def select(txs, search, opts):
+    """Yield the txs (and postings) ledger would report for search and opts."""
+    words = opts.split()
+    begin = end = None
+    for idx, word in enumerate(words):
+        if word in ("-b", "--begin"): begin = parse_date(words[idx+1])
+        if word in ("-e", "--end"): end = parse_date(words[idx+1])
+    related = "--related-all" in words
+    pats = [re.compile(term, re.I) for term in search.split()]
+    for tx in txs:
+        if begin and tx['date'] < begin: continue
+        if end and tx['date'] >= end: continue
+        if not pats:
+            yield tx
+            continue
+        matches = [p for p in tx['postings'] if [pat for pat in pats if pat.search(p['account_name'])]]
+        if not matches:
+            continue
+        if not related:
+            tx['postings'] = matches
+        yield tx
+
+def diff(native, xml):
+    """Compare two lists of transactions field by field and return a
+    list of human-readable differences. Random id tags and ledger's
+    internal account refs and commodity flags are ignored."""
+    ret = []
+    if len(native) != len(xml):
+        ret.append("native parser found %d transactions, xml found %d" % (len(native), len(xml)))
+    for (n, x) in zip(native, xml):
+        where = "%s %s" % (x.get_date(), x['payee'])
+        for field in ["date", "aux_date", "state", "code", "payee", "note"]:
+            if n[field] != x[field]:
+                ret.append("%s: %s is %r (native) vs %r (xml)" % (where, field, n[field], x[field]))
+        ntags = dict((k,v) for k,v in n['tags'].items() if k != 'id')
+        xtags = dict((k,v) for k,v in x['tags'].items() if k != 'id')
+        if ntags != xtags:
+            ret.append("%s: tags are %r (native) vs %r (xml)" % (where, ntags, xtags))
+        if len(n['postings']) != len(x['postings']):
+            ret.append("%s: %d postings (native) vs %d (xml)" % (where, len(n['postings']), len(x['postings'])))
+        for (np, xp) in zip(n['postings'], x['postings']):
+            for field in ["account_name", "amount", "commodity", "state", "note", "aux_date"]:
+                if np[field] != xp[field]:
+                    ret.append("%s: posting %s is %r (native) vs %r (xml)" % (where, field, np[field], xp[field]))
+    return ret
@@ -2,13 +2,15 @@
 Code related to parsing or representing ledger files.
 """
 
-import dateutil, os, subprocess, sys
-from decimal import Decimal, ROUND_HALF_UP
+import atexit, csv, datetime, dates, hashlib, multiprocessing, os, re, subprocess, tempfile, threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import xml.etree.ElementTree as ET
 
-from util import pp, pf
-
-from transactions import ParseError, Transaction, Transactions, Posting
+from transactions import ParseError, Transaction, Transactions, Posting, write_buffer
+import journal
+import money
+from cache import Cache, file_hash
 import util as u
 from config import config as c
 
@@ -18,12 +20,210 @@ log = logger.get_logger()
 def strip(a,b,c):
     return ''.join(c).strip()
 
-def call_ledger(cmd, fname="", stdin="", start_date=""):
+def starts_tx(line):
+    """True if line is the date line of a transaction."""
+    if not line[:1].isdigit():
+        return False
+    stub = line.split(" ",1)[0]
+    if '=' in stub: stub = stub.split("=",1)[0]
+    return dates.try_parse(stub) != None
+
+def amble_offsets(lines):
+    """lines are the lines of a journal file. Return (preamble_end,
+    postamble_start), the byte offsets in the file of the end of
+    everything before the first transaction (comments, directives,
+    includes) and the start of everything after the last one.
+
+    The postamble starts at the first line after the last transaction
+    that isn't blank or indented, so it doesn't pick up the end of
+    that transaction or the blank line we write after every one, and
+    exporting twice gives the same file. If there are no transactions,
+    the whole file is preamble.
+
+    """
+    # Only the ends of the file get looked at, not the transactions.
+    size = sum([len(line) + 1 for line in lines]) - 1 # no newline after the last line
+    preamble_end = 0
+    for line in lines:
+        if starts_tx(line):
+            break
+        preamble_end += len(line) + 1
+    else:
+        return (size, size)
+    postamble_start = size + 1
+    start = None # where the postamble starts, as of the last line we checked
+    for line in reversed(lines):
+        if starts_tx(line):
+            break
+        postamble_start -= len(line) + 1
+        if line and not line[0] in " \t":
+            start = postamble_start
+    return (preamble_end, size if start == None else start)
+
+def included_file(fname, line):
+    """If line (from the journal fname) is an include directive, return
+    the name of the file it includes, else None."""
+    if not line.startswith("include "):
+        return None
+    new_fname = line.split("include ",1)[1]
+    if not new_fname.startswith("/"):
+        dirs = os.path.split(fname)[:-1]
+        new_fname = os.path.join(os.path.join(*dirs), new_fname)
+    return new_fname
+
+def journal_files(fname):
+    """Return fname and every file it includes, directly or not."""
+    files = [fname]
+    for fname in files:
+        for line in u.slurp(fname):
+            new_fname = included_file(fname, line)
+            if new_fname and not new_fname in files:
+                files.append(new_fname)
+    return files
+
+class Ledger_Session(object):
+    """A ledger process left running in its interactive mode on one
+    journal. Queries are written to its stdin one per line and we
+    read the reply back off stdout, so the journal only gets parsed
+    once per session instead of once per query.
+
+    Ledger has no end-of-reply marker, so after each query we send an
+    echo command with a sentinel and read until we see it come back.
+    (The sentinel can't start with a dash, or ledger would take it for
+    an option.) stderr is folded into stdout so error messages can't
+    block the pipe. Ledger prints a banner when it starts, which we
+    read past the same way.
+
+    """
+    sentinel = "anvil-end-of-reply"
+    prompt_pat = re.compile(r"^(?:\] )+", re.M)
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.files = journal_files(journal)
+        self.stamp = self.get_stamp()
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(["ledger", "-f", journal], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.proc.stdin.write("echo {0}\n".format(self.sentinel))
+        self.proc.stdin.flush()
+        self.read_reply()
+
+    def get_stamp(self):
+        """The mtime and size of the journal and every file it includes."""
+        stamp = []
+        for fname in self.files:
+            st = os.stat(fname)
+            stamp.append((fname, st.st_mtime, st.st_size))
+        return stamp
+
+    def stale(self):
+        """True if ledger has exited or the journal (or one of its
+        includes) changed on disk since we started."""
+        try:
+            return self.proc.poll() != None or self.get_stamp() != self.stamp
+        except OSError:
+            return True
+
+    def read_reply(self):
+        """Read lines up to the sentinel and return them, prompts removed."""
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise IOError("ledger session on %s exited" % self.journal)
+            if self.sentinel in line:
+                break
+            lines.append(line)
+        return self.prompt_pat.sub("", "".join(lines))
+
+    def query(self, cmd):
+        """Send cmd (a ledger command line without the ledger or -f
+        parts) and return what ledger printed in reply."""
+        self.proc.stdin.write("{0}\necho {1}\n".format(cmd, self.sentinel))
+        self.proc.stdin.flush()
+        reply = self.read_reply()
+        for line in reply.split("\n"):
+            if line.startswith("Error:"):
+                log.debug("Ledger error: {0}".format(reply))
+                raise ParseError("Ledger could not parse {0} with cmd {1}. Please correct the file.".format(self.journal, cmd))
+        return reply
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+
+class Ledger_Pool(object):
+    """Keeps up to `size` Ledger_Sessions open per journal and hands
+    queries to whichever one is idle. Sessions whose journal changed
+    on disk get closed and respawned. A size of 0 turns the pool off.
+
+    """
+    def __init__(self, size=2):
+        self.size = size
+        self.sessions = {}
+        self.turn = 0
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def get(self, journal):
+        """Return a session on journal with its lock held. Caller releases it."""
+        with self.lock:
+            sessions = self.sessions.setdefault(journal, [])
+            for session in [s for s in sessions if s.stale()]:
+                if session.lock.acquire(False):
+                    sessions.remove(session)
+                    session.close()
+            for session in sessions:
+                if session.lock.acquire(False):
+                    return session
+            if len(sessions) < self.size:
+                session = Ledger_Session(journal)
+                session.lock.acquire()
+                sessions.append(session)
+                return session
+            self.turn += 1
+            session = sessions[self.turn % len(sessions)]
+        session.lock.acquire()
+        return session
+
+    def query(self, journal, cmd):
+        session = self.get(journal)
+        try:
+            return session.query(cmd)
+        finally:
+            session.lock.release()
+
+    def close(self):
+        with self.lock:
+            for sessions in self.sessions.values():
+                for session in sessions:
+                    session.close()
+            self.sessions = {}
+
+pool = Ledger_Pool(c.get('ledger-pool-size', 2))
+
+def call_ledger(cmd, fname="", stdin="", start_date="", journal=None):
     """This calls ledger and returns the result. If ledger writes to
     stderr, we complain and raise ParseError
 
+    If journal is given, cmd shouldn't have a -f in it. We'll send
+    the query to a long-lived ledger session from the pool and only
+    spawn a one-shot ledger if the pool is off or the session dies.
+    Queries that need stdin always get a one-shot ledger.
+
     """
     if start_date: start_date = "-b " + start_date
+    if journal and not stdin and pool.size:
+        try:
+            return pool.query(journal, "{0} {1}".format(cmd, start_date))
+        except (IOError, OSError) as e:
+            log.debug("Ledger pool failed, falling back to one-shot ledger: {0}".format(e))
+    if journal:
+        cmd = "-f {0} {1}".format(u.shellquote(journal), cmd)
     cmd = "ledger {1} {0}".format(cmd, start_date)
     proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     (stdout, stderr) = proc.communicate(stdin)
@@ -34,68 +234,186 @@ def call_ledger(cmd, fname="", stdin="", start_date=""):
         raise ParseError("Ledger could not parse {0} with cmd {1}. Please correct the file.".format(fname, cmd))
     return stdout            
 
+def stream_ledger(cmd, consume, fname="", stdin=""):
+    """Like call_ledger, but instead of returning ledger's output, hand
+    its stdout to consume() to read while ledger is still writing.
+    stdin is fed from a thread so neither pipe can fill up and
+    deadlock us, and stderr goes to a temp file for the same reason.
+
+    """
+    cmd = "ledger {0}".format(cmd)
+    errors = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors)
+    def feed():
+        try:
+            proc.stdin.write(stdin)
+        except IOError:
+            pass # ledger quit early. We'll hear about it on stderr.
+        finally:
+            proc.stdin.close()
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+    failed = None
+    try:
+        consume(proc.stdout)
+    except ET.ParseError as e:
+        failed = e
+    finally:
+        proc.stdout.close()
+        feeder.join()
+        proc.wait()
+    errors.seek(0)
+    stderr = errors.read()
+    errors.close()
+    if stderr and (failed or proc.returncode):
+        log.debug("Ledger error: {0}".format(stderr))
+        if not fname:
+            fname = "the ledger file"
+        raise ParseError("Ledger could not parse {0} with cmd {1}. Please correct the file.".format(fname, cmd))
+    if failed:
+        raise failed
+
 class Ledger(Transactions):
+    """A Transactions list loaded from a ledger journal and its includes.
+
+    parser picks how each file gets turned into transactions: "xml"
+    runs it through `ledger xml`, "native" reads it directly with the
+    journal module and "verify" does both, keeps the xml results and
+    logs every place the two disagree. The native parser falls back to
+    xml for searches and options it can't reproduce.
+
+    With stream set, the xml parser reads ledger's output incrementally
+    instead of holding the whole document in memory.
+
+    Unless cache is False (or ledger-cache is false in config.json),
+    the transactions parsed from each file are kept in the "ledger"
+    Cache and reused until that file changes.
+
+    """
     search = ''
 
-    def __init__(self, fname=None, search="", opts=""):
+    # Bump this whenever parse_file() would produce something different
+    # (e.g. a change to journal.py or xml_to_tx), so cached
+    # transactions from the old parser get ignored.
+    version = 1
+
+    def __init__(self, fname=None, search="", opts="", parser=None, stream=None, cache=None):
         Transactions.__init__(self)
+        self.sources = OrderedDict()
+        self.loaded_with = (search, opts)
         if not fname: fname = c['ledger-file']
+        if not parser: parser = c.get('ledger-parser', 'xml')
+        if stream == None: stream = c.get('ledger-xml-stream', False)
+        if cache == None: cache = c.get('ledger-cache', True)
         self.search = search
         self.opts = opts
         self.fname = fname
         self.name = self.fname
+        self.parser = parser
+        self.stream = stream
+        self.cache = Cache("ledger") if cache else None
 
     def get_pre_and_post_amble(self, fname=None):
+        """Return the text of fname before its first tx (the preamble)
+        and after its last one (the postamble). If we scanned fname
+        and it hasn't changed since, just read those bytes back.
+        Otherwise find them again (see amble_offsets)."""
         if not fname:
             fname = self.fname
+        source = self.sources.get(fname, {})
+        if 'preamble_end' in source:
+            with open(fname, 'rb') as INF:
+                st = os.fstat(INF.fileno())
+                if ((st.st_mtime, st.st_size) == (source['mtime'], source['size'])
+                    or file_hash(fname) == source['sha1']):
+                    preamble = INF.read(source['preamble_end'])
+                    INF.seek(source['postamble_start'])
+                    return (preamble, INF.read())
+            log.warning("{0} changed since we read it, so its pre and postamble might not be what we loaded with".format(fname))
         lines = u.slurp(fname)
-        self.preamble = ""
-        self.postamble = []
-        now = dateutil.parser.parse("")
-        for line in lines:
-            try:
-                stub = line.split(" ",1)[0]
-                if '=' in stub: stub = stub.split("=",1)[0]
-                if dateutil.parser.parse(stub) != now:
-                    break
-            except TypeError:
-                pass
-            self.preamble += line + "\n"
-
-        for line in reversed(lines): 
-            try:
-                if dateutil.parser.parse(line.split(" ",1)[0]) != now:
-                    break
-            except TypeError:
-                pass
-            self.postamble.insert(0,line)
-        
-        for line in self.postamble:
-            if not line: break
-            if line[0] in " \t\n":
-                self.postamble = self.postamble[1:]
-        self.postamble = "\n".join(self.postamble)
-        return (self.preamble, self.postamble)
+        (preamble_end, postamble_start) = amble_offsets(lines)
+        text = "\n".join(lines)
+        return (text[:preamble_end], text[postamble_start:])
+
+    def write_journal(self, fname, txs, orig_fname=None):
+        """Write txs to fname between the pre and postamble of orig_fname
+        (default fname), if it exists.
+
+        We write to a temp file next to fname and rename it into place,
+        so a crash leaves the old file or the new one, never half of
+        one. If the new file would be byte for byte the same as the old
+        one, we leave the old one alone. Return True if fname changed.
+
+        If fname is one of our sources, we update its entry in
+        self.sources to describe what we wrote.
+
+        """
+        if not orig_fname:
+            orig_fname = fname
+        if os.path.exists(orig_fname):
+            (preamble, postamble) = self.get_pre_and_post_amble(orig_fname)
+        else:
+            (preamble, postamble) = ("", "")
+        if not isinstance(txs, Transactions):
+            part = Transactions()
+            part.extend(txs)
+            txs = part
+        (directory, base) = os.path.split(os.path.abspath(fname))
+        (fd, temp) = tempfile.mkstemp(dir=directory, prefix="." + base + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', write_buffer) as OUTF:
+                OUTF.write(preamble)
+                txs.write_to(OUTF)
+                OUTF.write(postamble)
+                # Make sure the data is on disk before the rename is
+                OUTF.flush()
+                os.fsync(OUTF.fileno())
+            changed = not (os.path.exists(fname)
+                           and os.path.getsize(fname) == os.path.getsize(temp)
+                           and file_hash(fname) == file_hash(temp))
+            if fname in self.sources:
+                st = os.stat(temp if changed else fname)
+                self.sources[fname] = {'mtime':st.st_mtime, 'size':st.st_size, 'sha1':file_hash(temp),
+                                       'preamble_end':len(preamble), 'postamble_start':st.st_size - len(postamble)}
+            if not changed:
+                os.remove(temp)
+                return False
+            if os.path.exists(fname):
+                mode = os.stat(fname).st_mode
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0666 & ~umask
+            os.chmod(temp, mode & 07777) # mkstemp makes it 0600
+            os.rename(temp, fname)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        return True
+
     def export_file(self, fname, orig_fname=None):
         """Write ledger file to fname. Try to pull transactions out of the
         original file. If no original file specified, try to pull
         it from the file we're writing to.
+
+        Returns True if fname changed (see write_journal).
         
         """
-        if not orig_fname:
-            orig_fname = fname
-        if os.path.exists(orig_fname):
-            self.get_pre_and_post_amble(orig_fname)
-        else:
-            self.preamble = ""
-            self.postambe = ""
-        with open(fname, 'w') as OUTF:
-            OUTF.write(self.preamble)
-            OUTF.write(self.__unicode__().encode('utf8'))
-            OUTF.write(self.postamble)
+        return self.write_journal(fname, self, orig_fname)
+
     def export(self, fname=None):
         """If you don't specify a file, we'll write out to the files where entries come from.
-        New entries that don't have an original file associated will go to a random file.
+        New entries that don't have an original file associated will
+        go to the main journal file (or, if nothing came from it, the
+        first file we saw).
+
+        Files that would come out unchanged aren't touched. The rest
+        are written in parallel on up to ledger-export-workers threads
+        (default: one per cpu), each to a temp file that gets renamed
+        into place. Returns the list of files that changed.
 
         If you do specify an fname, we'll combine all the entries into
         one file and not bother with pre and postamble
@@ -104,33 +422,72 @@ class Ledger(Transactions):
 
         # fname specified
         if fname:
-            with open(fname, 'w') as OUTF:
-                OUTF.write(self.__unicode__().encode('utf8'))
-                return
+            self.write(fname)
+            return [fname]
         
-        # no fname
-        seen = list(set([tx['fname'] for tx in self if 'fname' in tx]))
-
-        for name in seen:
-            temp = Ledger()
-            for tx in self:
-                if tx['fname'] == name:
-                    temp.append(tx)
-            temp.export_file(name)
-
-        temp = Ledger()
+        # no fname: sort the txs into their files in one pass
+        by_file = OrderedDict()
+        unfiled = []
         for tx in self:
-            if not 'fname' in tx:
-                temp.append(tx)
-        if len(temp) > 0:
-            if len(seen) > 0:
-                temp.export_file(name, seen[0])
+            name = tx.get('fname')
+            if name:
+                by_file.setdefault(name, []).append(tx)
+            else:
+                unfiled.append(tx)
+        if not by_file:
+            if unfiled:
+                log.warning("None of the transactions came from a file, so there's nowhere to export them")
+            return []
+        if unfiled:
+            name = self.fname if self.fname in by_file else by_file.keys()[0]
+            by_file[name].extend(unfiled)
+
+        def export_one(name):
+            if not self.write_journal(name, by_file[name]):
+                return None
+            log.debug("Exported " + name)
+            return name
+
+        names = by_file.keys()
+        workers = min(len(names), c.get('ledger-export-workers', multiprocessing.cpu_count()))
+        if workers > 1:
+            workers = ThreadPool(workers)
+            try:
+                changed = workers.map(export_one, names)
+            finally:
+                workers.close()
+                workers.join()
+        else:
+            changed = map(export_one, names)
+        return filter(None, changed)
 
     def parse_xml(self, xml, fname=None):
         """Take output from Ledger's xml command and parse it.
 
         Also remember the name of file it came from."""
-
+        for tx in ET.fromstring(xml).find('transactions'):
+            self.append(self.xml_to_tx(tx, fname))
+
+    def parse_xml_stream(self, stream, fname=None):
+        """Like parse_xml, but read ledger's xml from a file object as it
+        arrives. Each Transaction gets built as soon as its
+        <transaction> element closes and the element is then thrown
+        away, so we only ever hold one transaction's worth of xml."""
+        transactions = None
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                if elem.tag == "transactions":
+                    transactions = elem
+                continue
+            if elem.tag == "transaction" and transactions is not None:
+                self.append(self.xml_to_tx(elem, fname))
+                elem.clear()
+                transactions.remove(elem)
+            elif elem.tag in ("accounts", "commodities"):
+                elem.clear()
+
+    def xml_to_tx(self, tx, fname=None):
+        """Make a Transaction from one <transaction> element of ledger's xml."""
         def set_if_found(tx, t, field, default=None, force_default=False, rename_field=None):
             temp = tx.find(field)
             if temp != None:
@@ -144,40 +501,150 @@ class Ledger(Transactions):
                 else:
                     t[field] = default
 
-        for tx in ET.fromstring(xml).find('transactions'):
-            t = Transaction()
-            t['fname'] = fname
-            t['state'] = tx.attrib.setdefault('state', '')
-            t['date'] = dateutil.parser.parse(tx.find('date').text)
-            if tx.find('aux-date') != None: t['aux_date'] = dateutil.parser.parse(tx.find('aux-date').text)
-            set_if_found(tx, t, 'code', '')
-            set_if_found(tx, t, 'payee', 'PAYEE UNKNOWN')
-            set_if_found(tx, t, 'note', '')
-
-            # parse tags
-            metadata = tx.find('metadata')
-            if metadata != None:
-                for tag in metadata.findall('tag'):
-                    t['tags'][tag.text] = None
-                for tag in metadata.findall('value'):
-                    t['tags'][tag.attrib["key"]] = tag.find("string").text
-
-            for posting in tx.find('postings'):
-                p = {}
-                p['account_name'] = posting.find('account').find('name').text
-                p['account_ref'] = posting.find('account').attrib['ref']
-                amt = posting.find('post-amount').find('amount')
-                p['commodity'] = amt.find('commodity').find('symbol').text
-                p['commodity_flags'] = amt.find('commodity').attrib['flags']
-                p['amount'] = Decimal(amt.find('quantity').text)
-                p['state'] = posting.attrib.setdefault('state', '')
-                set_if_found(posting, p, 'note', '')
-                p['tx'] = t # point back at parent
-                set_if_found(posting, p, 'aux-date', rename_field="aux_date")
-                if 'aux_date' in p:
-                    p['aux_date'] = dateutil.parser.parse(p['aux_date'])
+        t = Transaction()
+        t['fname'] = fname
+        t['state'] = tx.attrib.setdefault('state', '')
+        t['date'] = dates.parse(tx.find('date').text)
+        try:
+            if tx.find('aux-date') != None: t['aux_date'] = tx.find('aux-date').text # parsed when first used
+        except ValueError as e:
+            raise ParseError("{0} in {1}".format(e, fname or "the ledger file"))
+        set_if_found(tx, t, 'code', '')
+        set_if_found(tx, t, 'payee', 'PAYEE UNKNOWN')
+        set_if_found(tx, t, 'note', '')
+
+        # parse tags
+        metadata = tx.find('metadata')
+        if metadata != None:
+            for tag in metadata.findall('tag'):
+                t['tags'][tag.text] = None
+            for tag in metadata.findall('value'):
+                t['tags'][tag.attrib["key"]] = tag.find("string").text
+
+        for posting in tx.find('postings'):
+            p = {}
+            p['account_name'] = posting.find('account').find('name').text
+            p['account_ref'] = posting.find('account').attrib['ref']
+            amt = posting.find('post-amount').find('amount')
+            p['commodity'] = amt.find('commodity').find('symbol').text
+            p['commodity_flags'] = amt.find('commodity').attrib['flags']
+            p['amount'] = money.parse(amt.find('quantity').text)
+            p['state'] = posting.attrib.setdefault('state', '')
+            set_if_found(posting, p, 'note', '')
+            p['tx'] = t # point back at parent
+            set_if_found(posting, p, 'aux-date', rename_field="aux_date") # parsed when first used
+            try:
                 t['postings'].append(Posting(**p))
-            self.append(t)
+            except ValueError as e:
+                raise ParseError("{0} in {1}".format(e, fname or "the ledger file"))
+        return t
+
+    def parse_file(self, lines, fname, search, opts):
+        """Turn the lines of one journal file (includes removed) into
+        transactions with whichever parser self.parser names and add
+        them to self."""
+        parser = self.parser
+        if parser != "xml" and not journal.supported(search, opts):
+            log.debug("Native parser can't handle search '{0}' with opts '{1}', using xml".format(search, opts))
+            parser = "xml"
+        if parser == "native":
+            self.extend(journal.select(journal.parse(lines, fname), search, opts))
+            return
+
+        cmd = "-f - {0} xml {1}".format(opts, search)
+        text = "".join([line + "\n" for line in lines])
+        if parser == "xml" and self.stream:
+            stream_ledger(cmd, lambda stdout: self.parse_xml_stream(stdout, fname), fname, text)
+            return
+
+        xml = call_ledger(cmd, fname, text)
+        if parser == "verify":
+            native = list(journal.select(journal.parse(lines, fname), search, opts))
+            start = len(self)
+            self.parse_xml(xml, fname)
+            for problem in journal.diff(native, self[start:]):
+                log.warning("{0}: {1}".format(fname, problem))
+        else:
+            self.parse_xml(xml, fname)
+
+    def scan(self, fname=None):
+        """Follow include directives starting from fname and return a
+        list of (fname, lines, source) for every journal file, in the
+        order ledger would read them, with the include lines taken out.
+        source is a dict with the file's mtime, size and sha1 as of
+        when we read it, and preamble_end and postamble_start, the
+        byte offsets export needs (see amble_offsets).
+
+        This only reads the files, so it's cheap enough to do before
+        we start parsing anything.
+
+        """
+        if not fname:
+            fname = self.fname
+        ret = []
+        files_to_load = [fname]
+        for fname in files_to_load:
+            if fname in [f[0] for f in ret]:
+                continue
+            log.debug("Scanning " + fname)
+            st = os.stat(fname)
+            text = u.slurp(fname, split=False)
+            all_lines = text.split("\n")
+            source = {'mtime':st.st_mtime, 'size':st.st_size, 'sha1':hashlib.sha1(text).hexdigest()}
+            (source['preamble_end'], source['postamble_start']) = amble_offsets(all_lines)
+            lines = []
+            for line in all_lines:
+                new_fname = included_file(fname, line)
+                if new_fname:
+                    files_to_load.append(new_fname)
+                else:
+                    lines.append(line)
+            ret.append((fname, lines, source))
+        return ret
+
+    def parse_files(self, files, search, opts):
+        """Parse the (fname, lines, source) triples from scan() and return
+        a list of transaction lists, one per file, in the same order.
+
+        The files don't depend on each other, so we parse them on a
+        pool of up to ledger-load-workers threads (default: one per
+        cpu). Most of the time is spent waiting on ledger subprocesses,
+        so threads are enough.
+
+        """
+        date_format = "%Y/%m/%d"
+        ledger_opts = "--date-format %s %s" % (date_format, opts)
+
+        # verify runs are there to cross-check the parsers, so they
+        # always parse and never use or fill the cache
+        cache = self.cache if self.parser != "verify" else None
+
+        def load_file(file_lines_source):
+            (fname, lines, source) = file_lines_source
+            if cache:
+                key = (fname, os.path.abspath(fname), search, ledger_opts, self.parser, Ledger.version)
+                txs = cache.get(key, fname)
+                if txs != None:
+                    log.debug("Loading " + fname + " from cache")
+                    return txs
+            log.debug("Loading " + fname)
+            part = Ledger(fname, search, opts, parser=self.parser, stream=self.stream, cache=False)
+            part.parse_file(lines, fname, search, ledger_opts)
+            if cache:
+                stamp = dict((k, source[k]) for k in ('mtime', 'size', 'sha1'))
+                stamp['source'] = fname
+                cache.put(key, stamp, list(part))
+            return part
+
+        workers = min(len(files), c.get('ledger-load-workers', multiprocessing.cpu_count()))
+        if workers > 1:
+            workers = ThreadPool(workers)
+            try:
+                return workers.map(load_file, files)
+            finally:
+                workers.close()
+                workers.join()
+        return [load_file(f) for f in files]
 
     def load(self, search=None, opts=None):
         """Use ledger's xml function to get transactions.
@@ -190,37 +657,53 @@ class Ledger(Transactions):
         directives to load adjunct ledger files, then load those files
         ourselves.
 
-        """
-        def load_file(fname, files_to_load):
-            log.debug("Loading " + fname)
-            lines = u.slurp(fname)
-            ledger = ""
-            
-            for line in lines:
-                if line.startswith("include "):
-                    new_fname = line.split("include ",1)[1]
-                    if not new_fname.startswith("/"):
-                        dirs = os.path.split(fname)[:-1]
-                        new_fname = os.path.join(os.path.join(*dirs), new_fname)
-                    files_to_load.append(new_fname)
-                else:
-                    ledger += line + "\n"
-            return call_ledger("-f - {0} xml {1}".format(ledger_opts, search), fname, ledger)
+        We remember what each file looked like in self.sources so
+        refresh() can tell which ones changed later.
 
+        """
         if search == None:
             search = self.search
         if opts == None:
             opts = self.opts
+        self.loaded_with = (search, opts)
 
-        date_format = "%Y/%m/%d"
-        ledger_opts = "--date-format %s %s" % (date_format, opts)
-
-        files_to_load=[self.fname] 
-        for fname in files_to_load:
-            xml = load_file(fname, files_to_load) # note: this appends to files_to_load
-            self.parse_xml(xml, fname)
+        files = self.scan()
+        for part in self.parse_files(files, search, opts):
+            self.extend(part)
+        self.sources = OrderedDict((fname, source) for (fname, lines, source) in files)
         self.sort()
         #self.write("main.print.ledger")
+
+    def refresh(self):
+        """Pick up edits to the journal since load() without reloading
+        everything. Files whose contents changed (or that are newly
+        included) get reparsed, files that are no longer included get
+        dropped, and the rest of the transactions stay as they are.
+        Transactions with no fname (i.e. not from a file yet) are kept.
+
+        Returns the list of files that were reparsed or dropped.
+
+        """
+        (search, opts) = self.loaded_with
+        files = self.scan()
+        names = [f[0] for f in files]
+        changed = [f for f in files if self.sources.get(f[0], {}).get('sha1') != f[2]['sha1']]
+        dropped = [fname for fname in self.sources if not fname in names]
+        stale = set([f[0] for f in changed] + dropped)
+        if not stale:
+            self.sources = OrderedDict((fname, source) for (fname, lines, source) in files)
+            return []
+        log.debug("Refreshing " + ", ".join(sorted(stale)))
+
+        keep = [tx for tx in self if tx.get('fname') not in stale]
+        del self[:]
+        self.extend(keep)
+        for part in self.parse_files(changed, search, opts):
+            self.extend(part)
+        self.sources = OrderedDict((fname, source) for (fname, lines, source) in files)
+        self.sort()
+        return sorted(stale)
+
 class Balance(dict):
     """Run a balance command and represent the results."""
     def __init__(self, search="", opts="", fname=None):
@@ -235,8 +718,8 @@ class Balance(dict):
     def run(self):
         """Run the balance command from ledger and grab the results
         """
-        cmd_line = "-f " + self.fname + " " + self.opts + " balance " + self.search
-        self.bal_lines = call_ledger(cmd_line, self.fname).split("\n")
+        cmd_line = self.opts + " balance " + self.search
+        self.bal_lines = call_ledger(cmd_line, self.fname, journal=self.fname).split("\n")
 
         if self.bal_lines == ['']:
             self.balance = 0
@@ -245,4 +728,48 @@ class Balance(dict):
         for line in self.bal_lines:
             if self.search in line:
                 line = line.split(self.search,1)[0].strip()
-                self.balance = Decimal( line.replace(",","").replace("$","") )
+                self.balance = money.parse(line)
+
+class Balances(dict):
+    """Balances of several accounts as of several dates, from a single
+    ledger run. self[date][account] is the total of the postings to
+    accounts matching account (a regex, like ledger's search terms)
+    dated before date, which is what `ledger -e <date> balance
+    <account>` would say.
+
+    We ask ledger for every matching posting in its csv format, which
+    is easy to parse reliably, and add them up ourselves. Put options
+    like -C or --effective in opts.
+
+    """
+    def __init__(self, accounts, dates, opts="", fname=None):
+        dict.__init__(self)
+        if not fname: fname = c['ledger-file']
+        self.accounts = accounts
+        self.dates = dates
+        self.opts = opts
+        self.fname = fname
+        self.run()
+
+    def run(self):
+        if not self.dates:
+            return
+        pats = [(account, re.compile(account, re.I)) for account in self.accounts]
+        postings = dict((account, []) for account in self.accounts)
+        cmd_line = "--date-format %Y/%m/%d {0} -e {1} csv {2}".format(
+            self.opts, max(self.dates).strftime("%Y/%m/%d"), " ".join(self.accounts))
+        for row in csv.reader(call_ledger(cmd_line, self.fname, journal=self.fname).splitlines()):
+            if len(row) < 6:
+                continue
+            date = datetime.datetime.strptime(row[0], "%Y/%m/%d")
+            amount = money.parse(row[5])
+            for account, pat in pats:
+                if pat.search(row[3]):
+                    postings[account].append((date, amount))
+
+        for date in self.dates:
+            self[date] = {}
+        for account in self.accounts:
+            for date, total in zip(self.dates, u.totals_before(postings[account], self.dates)):
+                self[date][account] = total
+
@@ -0,0 +1,79 @@
+"""Amounts of money.
+
+Amounts are Decimals, unless config.json sets "integer-cents" to true.
+Then they are ints counting cents, which is exact for a book kept in
+dollars and cents, and sums and comparisons of ints are several times
+faster than Decimal's.
+
+Either way, amounts get parsed once, where we read them (ledger's
+output, journal files, bank statements), with parse(). They only turn
+back into Decimals at the edge, when we print them, with to_decimal().
+Code in between can add, subtract, negate and compare amounts (to each
+other and to 0) without caring which kind it has.
+
+In cents mode, an amount with a fraction of a cent is a ParseError
+rather than getting rounded.
+
+"""
+import re
+from decimal import Decimal, InvalidOperation
+from config import config as c
+from errs import ParseError
+
+cents = bool(c.get('integer-cents', False))
+
+cents_pat = re.compile(r"^(-?)(\d*)(?:\.(\d{0,2}))?$")
+
+def to_cents(amount):
+    """Return (cents, exact) for amount. exact is False if amount has
+    fractions of a cent, which get truncated."""
+    if cents and isinstance(amount, (int, long)):
+        return (amount, True)
+    if not isinstance(amount, Decimal):
+        amount = Decimal(amount)
+    try:
+        # py2's decimal keeps these around. Reading them directly is
+        # several times faster than as_tuple() or any Decimal math.
+        (sign, digits, exp) = (amount._sign, amount._int, amount._exp)
+    except AttributeError:
+        (sign, digits, exp) = amount.as_tuple()
+        digits = "".join(map(str, digits))
+    if exp >= -2:
+        (n, exact) = (int(digits) * 10 ** (exp + 2), True)
+    else:
+        cut = len(digits) + exp + 2
+        (n, exact) = (int(digits[:cut] or 0), not digits[max(cut, 0):].strip("0"))
+    return (-n if sign else n, exact)
+
+def from_cents(n):
+    """Return n cents as an amount."""
+    return int(n) if cents else Decimal(int(n)).scaleb(-2)
+
+def from_decimal(amount):
+    """Return a Decimal as an amount."""
+    if not cents:
+        return amount
+    (n, exact) = to_cents(amount)
+    if not exact:
+        raise ParseError("Amount %s is not a whole number of cents" % amount)
+    return n
+
+def parse(text):
+    """Return the amount in text, e.g. -1,234.56 or $1234.56"""
+    text = text.replace(",", "").replace("$", "").replace(" ", "")
+    if cents:
+        m = cents_pat.match(text)
+        if m and (m.group(2) or m.group(3)):
+            (sign, whole, frac) = m.groups()
+            n = int(whole or 0) * 100 + int((frac or "").ljust(2, "0"))
+            return -n if sign else n
+    try:
+        return from_decimal(Decimal(text))
+    except InvalidOperation:
+        raise ParseError("Can't parse amount: %s" % text)
+
+def to_decimal(amount):
+    """Return amount as a Decimal, for printing."""
+    if cents and isinstance(amount, (int, long)):
+        return Decimal(amount).scaleb(-2)
+    return amount
@@ -0,0 +1,63 @@
+import pytest, os, sys
+import dateutil
+from decimal import Decimal
+
+sys.path.insert(0, os.path.split(os.path.dirname(os.path.realpath(__file__)))[0])
+
+from ledger import Ledger
+from accountant import Monthly_Balancer, Reconciler
+from transactions import Posting, Transaction, Transactions
+
+def test_balances_sweep():
+    ledger = Ledger("main.ledger", parser="native", cache=False)
+    ledger.load()
+    cutoffs = [dateutil.parser.parse(d) for d in ["2015/01/01", "2014/06/02", "2014/06/03"]]
+    # Only the cleared Assets:Checking posting counts, on its aux date
+    assert Monthly_Balancer().balances(ledger, "Assets:Checking", cutoffs) == [Decimal("-33.32"), 0, Decimal("-33.32")]
+
+def make_tx(date, amount, state="cleared"):
+    tx = Transaction(date=dateutil.parser.parse(date), state=state)
+    tx['postings'] = [Posting(account_name="Assets:Checking", amount=Decimal(amount), tx=tx),
+                      Posting(account_name="Expenses:Misc", amount=-Decimal(amount), tx=tx)]
+    return tx
+
+def test_reconcile_match():
+    ledger = Transactions()
+    ledger.extend([make_tx("2015/01/02", "-10"), make_tx("2015/01/05", "-99"),
+                   make_tx("2015/01/09", "-20"), make_tx("2015/01/10", "-5", state="")])
+    account = Transactions()
+    account.bank_name, account.name = "Chase Bank", "Preferred Business Checking"
+    account.extend([make_tx("2015/01/01", "-10"), make_tx("2015/01/04", "-98"),
+                    make_tx("2015/01/11", "-20"), make_tx("2015/01/30", "-20")])
+    result = Reconciler(ledger, account).match()
+    # The early mismatch doesn't throw off the pairs after it
+    assert [(l['postings'][0]['amount'], a['date'].day) for l, a in result.matched] == [(-10, 1), (-20, 11)]
+    assert result.ledger == [ledger[1]]
+    assert result.account == [account[1], account[3]]
+    assert result.uncleared == [ledger[3]]
+
+def test_balances_sweep_without_numpy(monkeypatch):
+    import columns
+    monkeypatch.setattr(columns, 'available', False)
+    test_balances_sweep()
+
+@pytest.mark.parametrize("cents", [False, True])
+def test_balances_columns_agree(monkeypatch, cents):
+    pytest.importorskip("numpy")
+    import columns, money
+    monkeypatch.setattr(money, 'cents', cents)
+    txs = Transactions()
+    for date, amount, state in [("2015/01/30", "10.25", "cleared"), ("2015/02/01", "-3.10", ""),
+                                ("2015/02/15", "1.01", "cleared"), ("2015/03/01", "-0.99", "cleared")]:
+        tx = make_tx(date, amount, state)
+        for p in tx.postings:
+            p.amount = money.from_decimal(p.amount)
+        txs.append(tx)
+    txs[2].aux_date = dateutil.parser.parse("2015/01/20")
+    cutoffs = [dateutil.parser.parse(d) for d in ["2015/01/25", "2015/02/01", "2015/03/01", "2015/04/01"]]
+    with_view = Monthly_Balancer().balances(txs, "Assets:Checking", cutoffs)
+    monkeypatch.setattr(columns, 'available', False)
+    without = Monthly_Balancer().balances(txs, "Assets:Checking", cutoffs)
+    assert with_view == without
+    assert [type(b) for b in with_view] == [type(b) for b in without]
+    assert map(money.to_decimal, with_view) == [Decimal("1.01"), Decimal("11.26"), Decimal("11.26"), Decimal("10.27")]
@@ -10,3 +10,10 @@ def test_fix_paths():
     p = c['ledger-file']
     anvil.fix_paths()
     assert ( c['ledger-file'] == os.path.join(c['OTS-root'], c['ledger-file']) )
+
+def test_reconcile_display():
+    import display_cl, display_csv, display_html
+    assert anvil.Dispatch({}).reconcile_display is display_html
+    assert anvil.Dispatch({}).display is display_cl
+    assert anvil.Dispatch({'text':True}).reconcile_display is display_cl
+    assert anvil.Dispatch({'csv':True}).reconcile_display is display_csv
@@ -0,0 +1,65 @@
+import pytest, os, sys
+sys.path.insert(0, os.path.split(os.path.dirname(os.path.realpath(__file__)))[0])
+
+from config import config as c
+from cache import Cache
+import anvil
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setitem(c, 'cache-dir', str(tmpdir.join("cache")))
+    return tmpdir.join("cache")
+
+def test_get_and_put(tmpdir, cache_dir):
+    source = tmpdir.join("main.ledger")
+    source.write("one")
+    cache = Cache("ledger")
+    assert cache.get("key", str(source)) == None
+    cache.put("key", cache.stamp(str(source)), [1, 2])
+    assert cache.get("key", str(source)) == [1, 2]
+    assert cache.get("other key", str(source)) == None
+
+    # touched but not changed
+    os.utime(str(source), (0, 0))
+    assert cache.get("key", str(source)) == [1, 2]
+
+    # changed
+    source.write("two")
+    assert cache.get("key", str(source)) == None
+
+def test_version(tmpdir, cache_dir, monkeypatch):
+    source = tmpdir.join("main.ledger")
+    source.write("one")
+    cache = Cache("ledger")
+    cache.put("key", cache.stamp(str(source)), [1, 2])
+    monkeypatch.setattr(Cache, 'version', Cache.version + 1)
+    assert cache.get("key", str(source)) == None
+
+def test_purge_command(tmpdir, cache_dir, capsys):
+    source = tmpdir.join("main.ledger")
+    source.write("one")
+    for name in ["ledger", "statements"]:
+        cache = Cache(name)
+        cache.put(("key", name), cache.stamp(str(source)), name)
+    assert Cache.names() == ["ledger", "statements"]
+
+    anvil.Dispatch({}).cache(args=["purge"])
+    out = capsys.readouterr()[0]
+    assert "2 entries" in out and "purged" in out
+    assert [list(Cache(name).entries()) for name in Cache.names()] == [[], []]
+    assert Cache("ledger").get(("key", "ledger"), str(source)) == None
+
+    anvil.Dispatch({}).cache()
+    assert "The cache is empty." in capsys.readouterr()[0]
+
+def test_list_command(tmpdir, cache_dir, capsys):
+    source = tmpdir.join("2015_01.pdf")
+    source.write("one")
+    cache = Cache("statements")
+    stamp = cache.stamp(str(source))
+    cache.put((stamp['sha1'], None, 1, "Assets:Checking"), stamp, "statement")
+    assert [(e.source, e.sha1) for e in cache.entries()] == [(str(source), stamp['sha1'])]
+
+    anvil.Dispatch({}).cache()
+    out = capsys.readouterr()[0]
+    assert "|SHA1" in out and str(source) in out and stamp['sha1'] in out
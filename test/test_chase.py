@@ -0,0 +1,125 @@
+import pytest, os, sys
+from decimal import Decimal
+
+root = os.path.split(os.path.dirname(os.path.realpath(__file__)))[0]
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "banks"))
+
+from config import config as c
+from errs import ParseError
+import chase
+
+@pytest.fixture
+def statements_dir(tmpdir, monkeypatch):
+    monkeypatch.setitem(c, 'cache-dir', str(tmpdir.join("cache")))
+    monkeypatch.chdir(tmpdir)
+    statements = tmpdir.mkdir("statements")
+    statements.join("2015_01.txt").write(open(os.path.join(root, "test", "statements", "2015_01.txt")).read())
+    statements.join("2015_01.pdf").write("")
+    return statements
+
+def make_account(statements_dir):
+    return chase.Account(**{'statements-dir':str(statements_dir),
+                            'bank-name':"Chase Bank",
+                            'name':"Preferred Business Checking",
+                            'ledger-account':"Assets:Checking"})
+
+def test_statement_parse(statements_dir):
+    statement = chase.Statement(str(statements_dir.join("2015_01.pdf")), "Assets:Checking")
+    statement.parse()
+    assert statement['summary']['ending balance'] == Decimal("3319.50")
+    assert statement['account_num'] == Decimal("123456789")
+    assert len(statement.get_txs()) == 7
+    assert statement.get_txs().sum("Assets:Checking") == Decimal("2319.50")
+
+def test_load_from_statements_cached(statements_dir):
+    account = make_account(statements_dir)
+    account.load_from_statements()
+    again = make_account(statements_dir)
+    again.load_from_statements()
+    assert [unicode(tx) for tx in account] == [unicode(tx) for tx in again]
+
+def test_load_statement_sees_text_edits(statements_dir):
+    cache = chase.Cache("statements")
+    pdf = str(statements_dir.join("2015_01.pdf"))
+    assert "Deposit" in [tx['payee'] for tx in chase.load_statement(pdf, "Assets:Checking", cache).get_txs()]
+    text = statements_dir.join("2015_01.txt")
+    text.write(text.read().replace("Deposit   ", "Cash In   "))
+    assert "Cash In" in [tx['payee'] for tx in chase.load_statement(pdf, "Assets:Checking", cache).get_txs()]
+
+def test_load_from_statements_reports_every_error(statements_dir):
+    for name in ["2015_02", "2015_03"]:
+        statements_dir.join(name + ".txt").write("garbage\n")
+        statements_dir.join(name + ".pdf").write(name)
+    with pytest.raises(ParseError) as e:
+        make_account(statements_dir).load_from_statements()
+    assert "2015_02.pdf" in e.value.message
+    assert "2015_03.pdf" in e.value.message
+
+def test_intake(statements_dir, tmpdir, monkeypatch):
+    text = open(os.path.join(root, "test", "statements", "2015_01.txt")).read().replace("January 30, 2015", "February 27, 2015")
+    extracted = []
+    def extract_pdf(fname):
+        extracted.append(fname)
+        return text
+    monkeypatch.setattr(chase, "extract_pdf", extract_pdf)
+
+    tmpdir.join("StatementPdf1.pdf").write("pdf")
+    make_account(statements_dir).intake()
+    assert extracted == ["StatementPdf1.pdf"]
+    assert not tmpdir.join("StatementPdf1.pdf").exists()
+    assert statements_dir.join("2015_02.pdf").read() == "pdf"
+    assert statements_dir.join("2015_02.txt").read() == text
+
+    # The same PDF downloaded again doesn't get processed again
+    tmpdir.join("StatementPdf2.pdf").write("pdf")
+    make_account(statements_dir).intake()
+    assert extracted == ["StatementPdf1.pdf"]
+    assert tmpdir.join("StatementPdf2.pdf").exists()
+
+def test_intake_is_not_a_side_effect(statements_dir, tmpdir):
+    tmpdir.join("StatementPdf1.pdf").write("pdf")
+    make_account(statements_dir)
+    assert tmpdir.join("StatementPdf1.pdf").exists()
+
+def test_intake_shared_dir(statements_dir, tmpdir, monkeypatch):
+    text = open(os.path.join(root, "test", "statements", "2015_01.txt")).read().replace("January 30, 2015", "February 27, 2015")
+    texts = {"StatementPdf1.pdf":text,
+             "StatementPdf2.pdf":text.replace("000000123456789", "000000987654321")}
+    monkeypatch.setattr(chase, "extract_pdf", lambda fname: texts[fname])
+    accounts = c['banks']["Chase Bank"]['accounts']
+    monkeypatch.setitem(accounts, "Preferred Business Checking",
+                        dict(accounts["Preferred Business Checking"], **{'account-num':"123456789"}))
+    monkeypatch.setitem(accounts, "Savings", {'account-num':987654321})
+    savings_dir = tmpdir.mkdir("savings")
+    for fname in texts:
+        tmpdir.join(fname).write(fname)
+
+    savings = chase.Account(**{'statements-dir':str(savings_dir),
+                               'bank-name':"Chase Bank",
+                               'name':"Savings",
+                               'ledger-account':"Assets:Savings"})
+    assert savings.intake() == [str(savings_dir.join("2015_02.pdf"))]
+    assert savings_dir.join("2015_02.pdf").read() == "StatementPdf2.pdf"
+    assert tmpdir.join("StatementPdf1.pdf").exists()
+
+    assert make_account(statements_dir).intake() == [str(statements_dir.join("2015_02.pdf"))]
+    assert statements_dir.join("2015_02.pdf").read() == "StatementPdf1.pdf"
+
+def test_intake_dest_exists(statements_dir, tmpdir, monkeypatch):
+    text = open(os.path.join(root, "test", "statements", "2015_01.txt")).read()
+    monkeypatch.setattr(chase, "extract_pdf", lambda fname: text)
+
+    # Same content as the 2015_01.pdf we already have: skip it
+    tmpdir.join("StatementPdf1.pdf").write("")
+    assert make_account(statements_dir).intake() == []
+    assert tmpdir.join("StatementPdf1.pdf").exists()
+    account = make_account(statements_dir)
+    account.load_from_statements()
+    assert len(account.statements) == 1
+
+    # Different content under the same name is still an error
+    tmpdir.join("StatementPdf2.pdf").write("other")
+    with pytest.raises(ParseError) as e:
+        make_account(statements_dir).intake()
+    assert "already exists" in e.value.message
@@ -0,0 +1,54 @@
+import pytest, os, sys
+import dateutil
+from decimal import Decimal
+
+sys.path.insert(0, os.path.split(os.path.dirname(os.path.realpath(__file__)))[0])
+
+from namespace import Namespace
+from transactions import Posting, Transaction
+import display_cl, display_csv, display_html
+
+def make_tx(payee, amount, account):
+    tx = Transaction(date=dateutil.parser.parse("2015/01/02"), payee=payee, state="cleared", tags={})
+    tx['postings'] = [Posting(account_name=account, amount=Decimal(amount), tx=tx),
+                      Posting(account_name="Expenses:Misc", amount=-Decimal(amount), tx=tx)]
+    return tx
+
+def reconcile(module, output_file):
+    """Send two accounts' rows through one of module's Reconcile displays."""
+    d = module.Reconcile()
+    d.output_file = output_file
+    for account in ["Assets:Checking", "Assets:Savings"]:
+        ledger = make_tx("Coffee", "-3.50", account)
+        bank = make_tx("COFFEE SHOP", "-3.50", account)
+        d.start(account)
+        d.add(Namespace({'date':ledger.date, 'ledger':ledger, 'account':bank,
+                         'ledger_total':Decimal("-3.50"), 'account_total':Decimal("-3.50")}))
+        d.add(Namespace({'date':ledger.date, 'ledger':None, 'account':make_tx("FEE", "-1", account),
+                         'ledger_total':Decimal("-3.50"), 'account_total':Decimal("-4.50")}))
+        d.done(Namespace({'matched':[(ledger, bank)], 'ledger':[], 'account':[bank], 'uncleared':[]}))
+    d.close()
+    return open(output_file).read()
+
+def test_reconcile_cl(tmpdir):
+    out = reconcile(display_cl, str(tmpdir.join("out.txt")))
+    assert out.count("Reconciling ") == 2 and "Reconciling Assets:Savings" in out
+    assert "2015/01/02  matched      ledger        -3.50  bank        -3.50\n" in out
+    assert "2015/01/02  bank only    ledger        -3.50  bank        -4.50  *\n" in out
+    assert "  L 2015/01/02 * Coffee\n" in out and "  B 2015/01/02 * COFFEE SHOP\n" in out
+    assert out.count("1 matched, 0 only in the ledger, 1 only at the bank, 0 uncleared\n") == 2
+
+def test_reconcile_csv(tmpdir):
+    rows = reconcile(display_csv, str(tmpdir.join("out.csv"))).splitlines()
+    assert rows[0].startswith("Account,Date,Status,")
+    assert len(rows) == 5
+    assert rows[1] == "Assets:Checking,2015/01/02,matched,Coffee,$-3.50,COFFEE SHOP,$-3.50,$-3.50,$-3.50"
+    assert rows[4] == "Assets:Savings,2015/01/02,bank only,,,FEE,$-1,$-3.50,$-4.50"
+
+def test_reconcile_html(tmpdir):
+    out = reconcile(display_html, str(tmpdir.join("out.html")))
+    assert out.count("<html>") == 1 and out.endswith("</body></html>\n")
+    assert out.count("<table") == out.count("</table>") == 2
+    assert "<h2>Assets:Savings</h2>" in out
+    assert "<font color='green'>-3.50</font>" in out
+    assert "<font color='red'>Assets:Checking" in out
@@ -5,10 +5,16 @@ from decimal import Decimal
 sys.path.insert(0, os.path.split(os.path.dirname(os.path.realpath(__file__)))[0])
 
 from ledger import Ledger
+from transactions import Posting, Transaction
 import anvil
 
 from config import config as c
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """Keep the ledger cache out of ~/.cache/anvil"""
+    monkeypatch.setitem(c, 'cache-dir', str(tmpdir.join("cache")))
+
 @pytest.fixture
 def loaded_ledger():
     ledger = Ledger("test.ledger")
@@ -61,3 +67,268 @@ def test_tx_with_two_asset_postings_that_cancel(loaded_ledger):
             if abs(posting['amount']) == Decimal("100.30"):
                 found = True
     assert found
+
+@pytest.fixture
+def native_aux_date_ledger():
+    ledger = Ledger("aux-date.ledger", parser="native")
+    ledger.load()
+    return ledger
+
+def test_native_aux_dates(native_aux_date_ledger):
+    ledger = native_aux_date_ledger
+    assert ledger[0]['postings'][0]['aux_date'] == dateutil.parser.parse("2010/01/02")
+    assert ledger[0]['postings'][1]['aux_date'] == None
+    assert ledger[1]['aux_date'] == dateutil.parser.parse("2010/01/03")
+    assert ledger[3]['aux_date'] == None
+
+def test_xml_bad_aux_date():
+    from errs import ParseError
+    import xml.etree.ElementTree as ET
+    xml = """<ledger><transactions><transaction state="cleared">
+      <date>2015/01/02</date><aux-date>%s</aux-date><payee>Coffee</payee>
+      <postings><posting state="cleared">
+        <account ref="1"><name>Expenses:Coffee</name></account>
+        <post-amount><amount><commodity flags="P"><symbol>$</symbol></commodity>
+          <quantity>3.50</quantity></amount></post-amount>
+        <aux-date>%s</aux-date>
+      </posting></postings>
+    </transaction></transactions></ledger>"""
+    ledger = Ledger("main.ledger", cache=False)
+    ledger.parse_xml(xml % ("2015/01/03", "2015/01/04"), "main.ledger")
+    assert ledger[0].aux_date.day == 3 and ledger[0].postings[0].aux_date.day == 4
+    for bad in [xml % ("2015/02/30", "2015/01/04"), xml % ("2015/01/03", "2015/02/30")]:
+        with pytest.raises(ParseError) as e:
+            ledger.parse_xml(bad, "main.ledger")
+        assert "2015/02/30" in e.value.message and "main.ledger" in e.value.message
+
+def test_native_elided_amount(native_aux_date_ledger):
+    tx = native_aux_date_ledger[0]
+    assert tx['postings'][0]['amount'] == Decimal("20.10")
+    assert tx['postings'][1]['amount'] == Decimal("-20.10")
+    assert tx['postings'][1]['commodity'] == "$"
+
+def test_native_search():
+    ledger = Ledger("main.ledger", search="Checking", opts="--related-all -b 2015/01/01", parser="native")
+    ledger.load()
+    assert len(ledger) == 2
+    assert [len(tx['postings']) for tx in ledger] == [2, 2]
+
+def test_verify_skips_cache(monkeypatch):
+    parsed = []
+    def parse_file(self, lines, fname, search, opts):
+        parsed.append(fname)
+    monkeypatch.setattr(Ledger, "parse_file", parse_file)
+    for parser in ["native", "native", "verify", "verify"]:
+        Ledger("inc-a.ledger", parser=parser).load()
+    # native is cached after the first load, verify never is
+    assert len(parsed) == 6
+
+def test_load_includes_keep_fname():
+    ledger = Ledger("inc-a.ledger", parser="native")
+    ledger.load()
+    assert [tx['payee'] for tx in ledger] == ["Rent", "Coffee", "Rent"]
+    assert [tx['fname'] for tx in ledger] == ["inc-b.ledger", "inc-a.ledger", "inc-b.ledger"]
+
+def test_refresh_reparses_only_changed(tmpdir):
+    for name in ["inc-a.ledger", "inc-b.ledger"]:
+        tmpdir.join(name).write(open(name).read())
+    ledger = Ledger(str(tmpdir.join("inc-a.ledger")), parser="native", cache=False)
+    ledger.load()
+    assert ledger.refresh() == []
+    kept = [tx for tx in ledger if tx['fname'].endswith("inc-a.ledger")][0]
+
+    tmpdir.join("inc-b.ledger").write("2012/05/01 Rent\n    Expenses:Rent    $ 950.00\n    Assets:Checking\n")
+    assert ledger.refresh() == [str(tmpdir.join("inc-b.ledger"))]
+    assert [tx['payee'] for tx in ledger] == ["Coffee", "Rent"]
+    assert ledger[0] is kept
+    assert ledger[1]['postings'][0]['amount'] == Decimal("950.00")
+
+def test_export_to_one_file(tmpdir):
+    ledger = Ledger("inc-a.ledger", parser="native", cache=False)
+    ledger.load()
+    out = tmpdir.join("all.ledger")
+    ledger.export(str(out))
+    assert out.read() == unicode(ledger).encode('utf-8')
+    again = Ledger(str(out), parser="native", cache=False)
+    again.load()
+    assert [(tx['payee'], tx['postings'][0]['amount']) for tx in again] == [(tx['payee'], tx['postings'][0]['amount']) for tx in ledger]
+
+def test_export_by_file(tmpdir):
+    for name in ["inc-a.ledger", "inc-b.ledger"]:
+        tmpdir.join(name).write(open(name).read())
+    main = str(tmpdir.join("inc-a.ledger"))
+    ledger = Ledger(main, parser="native", cache=False)
+    ledger.load()
+    assert sorted(ledger.export()) == sorted([main, str(tmpdir.join("inc-b.ledger"))])
+    assert tmpdir.join("inc-a.ledger").read().startswith("; A journal split across include files")
+    assert ledger.refresh() == []
+
+    # nothing changed, so nothing gets written
+    assert ledger.export() == []
+
+    tx = Transaction(date=dateutil.parser.parse("2012/06/01"), payee="Tea")
+    tx['postings'] = [Posting(account_name="Expenses:Tea", amount=Decimal("2.00"), tx=tx),
+                      Posting(account_name="Assets:Checking", amount=Decimal("-2.00"), tx=tx)]
+    ledger.append(tx)
+    assert ledger.export() == [main]
+    assert sorted(os.listdir(str(tmpdir))) == ["inc-a.ledger", "inc-b.ledger"]
+    again = Ledger(main, parser="native", cache=False)
+    again.load()
+    assert [tx['payee'] for tx in again] == ["Rent", "Coffee", "Rent", "Tea"]
+
+def test_pre_and_post_amble_offsets(tmpdir, monkeypatch):
+    import ledger as ledger_module
+    journal = tmpdir.join("j.ledger")
+    journal.write("; head\n\n2012/03/01 Coffee\n    Expenses:Coffee    $ 3.50\n    Assets:Checking\n\n; tail\n")
+    ledger = Ledger(str(journal), parser="native", cache=False)
+    ledger.load()
+    assert ledger.get_pre_and_post_amble() == ("; head\n\n", "; tail\n")
+
+    # export splices the bytes we recorded while scanning, without looking for them again
+    def amble_offsets(lines):
+        raise AssertionError("rescanned")
+    with monkeypatch.context() as m:
+        m.setattr(ledger_module, "amble_offsets", amble_offsets)
+        assert ledger.export() == [str(journal)]
+        assert ledger.export() == []
+    text = journal.read()
+    assert text.startswith("; head\n\n2012/03/01 Coffee\n") and text.endswith("\n\n; tail\n")
+
+    # if the file changes underneath us, we notice and look again
+    journal.write("; new head\n" + text)
+    assert ledger.get_pre_and_post_amble() == ("; new head\n; head\n\n", "; tail\n")
+
+def test_native_non_ascii(tmpdir):
+    journal = tmpdir.join("cafe.ledger")
+    journal.write(u"2015/01/02 Caf\xe9 Ol\xe9  ; cr\xe8me\n    Expenses:Caf\xe9    $ 3.50\n    Assets:Checking\n".encode('utf-8'), mode='wb')
+    native = Ledger(str(journal), parser="native", cache=False)
+    native.load()
+    assert native[0]['payee'] == u"Caf\xe9 Ol\xe9"
+    assert native[0]['note'] == u" cr\xe8me"
+    assert native[0]['postings'][0]['account_name'] == u"Expenses:Caf\xe9"
+    assert u"Caf\xe9 Ol\xe9" in unicode(native[0])
+    native.export()
+    assert u"Caf\xe9 Ol\xe9".encode('utf-8') in journal.read('rb')
+
+fake_ledger = r'''#!%s
+# Acts like ledger: with a command on the command line it runs that
+# and exits, without one it's interactive, printing a banner and then
+# a "] " prompt before each command. It knows the options anvil uses
+# and rejects any others, as ledger does. csv replies end with a
+# comment line per option so tests can see what arrived.
+import os, sys
+options = {"-f":1, "-C":0, "--effective":0, "-b":1, "-e":1, "--date-format":1}
+def reply(words):
+    (opts, args) = ([], [])
+    while words:
+        word = words.pop(0)
+        if not word.startswith("-"):
+            args.append(word)
+        elif word in options:
+            opts.append(" ".join([word] + words[:options[word]]))
+            del words[:options[word]]
+        else:
+            return "Error: Illegal option %%s\n" %% word
+    if args[0] == "echo":
+        return " ".join(args[1:]) + "\n"
+    if args[0] == "csv":
+        return ('"2015/01/02","","Coffee","Expenses:Coffee","$","3.50","",""\n'
+                + "".join(["; %%s\n" %% opt for opt in opts if not opt.startswith("-f ")]))
+    return ""
+if len(sys.argv) > 3:
+    sys.stdout.write(reply(sys.argv[1:]))
+    sys.exit()
+if os.environ.get("FAKE_LEDGER_CRASH"):
+    sys.exit(1)
+sys.stdout.write("Ledger 3.1, the command-line accounting tool\n\n")
+while True:
+    sys.stdout.write("] ")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    sys.stdout.write(reply(line.split()))
+    sys.stdout.flush()
+'''
+
+@pytest.fixture
+def fake_ledger_dir(tmpdir, monkeypatch):
+    """Put fake_ledger on PATH as ledger and copy the inc-* journals
+    into tmpdir."""
+    script = tmpdir.mkdir("bin").join("ledger")
+    script.write(fake_ledger % sys.executable)
+    script.chmod(0755)
+    monkeypatch.setenv("PATH", str(tmpdir.join("bin")) + os.pathsep + os.environ["PATH"])
+    for name in ["inc-a.ledger", "inc-b.ledger"]:
+        tmpdir.join(name).write(open(name).read())
+    return tmpdir
+
+def test_ledger_session(fake_ledger_dir):
+    import ledger as ledger_module
+    tmpdir = fake_ledger_dir
+    session = ledger_module.Ledger_Session(str(tmpdir.join("inc-a.ledger")))
+    try:
+        assert session.files == [str(tmpdir.join("inc-a.ledger")), str(tmpdir.join("inc-b.ledger"))]
+        assert session.query("csv") == '"2015/01/02","","Coffee","Expenses:Coffee","$","3.50","",""\n'
+        assert session.query("csv") == '"2015/01/02","","Coffee","Expenses:Coffee","$","3.50","",""\n'
+        assert not session.stale()
+        tmpdir.join("inc-b.ledger").write("; edited\n", mode='a')
+        assert session.stale()
+    finally:
+        session.close()
+
+def test_ledger_pool_options(fake_ledger_dir, monkeypatch):
+    import ledger as ledger_module
+    pool = ledger_module.Ledger_Pool(1)
+    monkeypatch.setattr(ledger_module, "pool", pool)
+    journal = str(fake_ledger_dir.join("inc-a.ledger"))
+    try:
+        reply = ledger_module.call_ledger("--date-format %Y/%m/%d -C --effective -e 2015/02/01 csv Coffee",
+                                          journal=journal, start_date="2015/01/01")
+        assert reply.split("\n")[1:] == ["; --date-format %Y/%m/%d", "; -C", "; --effective",
+                                         "; -e 2015/02/01", "; -b 2015/01/01", ""]
+        session = pool.sessions[journal][0]
+        grid = ledger_module.Balances(["Coffee"], [dateutil.parser.parse("2015/01/03")], opts="-C --effective", fname=journal)
+        assert grid[dateutil.parser.parse("2015/01/03")]["Coffee"] == Decimal("3.50")
+        assert pool.sessions[journal] == [session] and not session.stale()
+    finally:
+        pool.close()
+
+def test_ledger_pool_fallback(fake_ledger_dir, monkeypatch):
+    import ledger as ledger_module
+    pool = ledger_module.Ledger_Pool(1)
+    monkeypatch.setattr(ledger_module, "pool", pool)
+    monkeypatch.setenv("FAKE_LEDGER_CRASH", "1")
+    journal = str(fake_ledger_dir.join("inc-a.ledger"))
+    try:
+        # The session dies on startup, so the query goes to a one-shot ledger
+        reply = ledger_module.call_ledger("-C --effective -e 2015/02/01 csv Coffee", journal=journal)
+        assert reply.split("\n")[1:] == ["; -C", "; --effective", "; -e 2015/02/01", ""]
+    finally:
+        pool.close()
+
+def test_balances(monkeypatch):
+    import ledger as ledger_module, util as u
+    from ledger import Balances
+    rows = [("2015/01/05", "Assets:Checking", "100.00"),
+            ("2014/12/31", "Assets:Checking:Fees", "-1,000.00"),
+            ("2015/02/01", "Assets:Checking", "-20"),
+            ("2015/01/10", "Assets:Savings", "50.00"),
+            ("2015/03/01", "Expenses:Misc", "5.00")]
+    calls = []
+    def call_ledger(cmd, fname="", stdin="", start_date="", journal=None):
+        calls.append(cmd)
+        return "\n".join(['"%s","","Payee","%s","$","%s","",""' % row for row in rows])
+    monkeypatch.setattr(ledger_module, "call_ledger", call_ledger)
+
+    cutoffs = [dateutil.parser.parse(d) for d in ["2015/02/01", "2015/01/01", "2015/03/01", "2014/01/01"]]
+    accounts = ["Assets:Checking", "Savings"]
+    grid = Balances(accounts, cutoffs, opts="-C", fname="main.ledger")
+    assert len(calls) == 1
+    assert "-e 2015/03/01" in calls[0] and "-C" in calls[0]
+    for account, pat in [("Assets:Checking", "Assets:Checking"), ("Savings", "Savings")]:
+        postings = [(dateutil.parser.parse(d), Decimal(amt.replace(",", ""))) for d, name, amt in rows if pat in name]
+        assert [grid[cutoff][account] for cutoff in cutoffs] == u.totals_before(postings, cutoffs)
+    assert grid[cutoffs[0]]["Assets:Checking"] == Decimal("-900.00")
+    assert grid[cutoffs[2]]["Assets:Checking"] == Decimal("-920.00")
+    assert grid[cutoffs[3]]["Savings"] == 0
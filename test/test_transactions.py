@@ -0,0 +1,208 @@
+import pytest, os, sys
+import cPickle as pickle
+import dateutil
+from decimal import Decimal
+
+sys.path.insert(0, os.path.split(os.path.dirname(os.path.realpath(__file__)))[0])
+
+from transactions import Posting, Transaction, Transactions
+
+def test_record_mapping_shim():
+    tx = Transaction(date=dateutil.parser.parse("2015/01/02"), payee="Coffee")
+    tx['postings'].append(Posting(account_name="Assets:Checking", amount=Decimal("-5"), tx=tx))
+    assert tx['payee'] == tx.payee == "Coffee"
+    assert tx['postings'][0].amount == Decimal("-5")
+    assert 'id' in tx['tags']
+    # fname is only there once it's set; other keys go in extra
+    assert not 'fname' in tx and tx.get('fname') == None
+    tx['fname'] = "main.ledger"
+    tx['match_ignore'] = True
+    assert 'fname' in tx and tx.setdefault('match_ignore', False) == True
+    assert not 'tags' in tx['postings'][0]
+    with pytest.raises(KeyError):
+        tx['nope']
+
+    copy = pickle.loads(pickle.dumps(tx, pickle.HIGHEST_PROTOCOL))
+    assert copy.fname == "main.ledger" and copy['match_ignore'] == True
+    assert copy.postings[0].tx is copy
+
+def test_columns():
+    pytest.importorskip("numpy")
+    txs = Transactions()
+    for date, amount, state in [("2015/01/30", "10.25", "cleared"), ("2015/02/01", "-3.10", ""), ("2015/02/15", "1", "")]:
+        tx = Transaction(date=dateutil.parser.parse(date), state=state)
+        tx['postings'] = [Posting(account_name="Assets:Checking", amount=Decimal(amount), tx=tx),
+                          Posting(account_name="Expenses:Misc", amount=-Decimal(amount), tx=tx)]
+        txs.append(tx)
+    view = txs.columns()
+    assert txs.columns() is view and view.exact
+    assert view.sum(view.accounts_under("assets")) == txs.sum("assets") == Decimal("8.15")
+    feb = view.between(dateutil.parser.parse("2015/02/01"), dateutil.parser.parse("2015/03/01"))
+    assert view.by_account(feb) == {"Assets:Checking":Decimal("-2.10"), "Expenses:Misc":Decimal("2.10")}
+    assert view.by_month(view.accounts_under("assets")).items() == [((2015, 1), Decimal("10.25")), ((2015, 2), Decimal("-2.10"))]
+    assert view.sum(view.cleared()) == 0
+    txs.append(txs[0])
+    assert txs.columns() is not view
+
+def test_account_trie():
+    txs = Transactions()
+    for account, amount in [("Assets:Checking", "10"), ("Assets:Checking:Fees", "-1"),
+                            ("Assets:Savings", "5"), ("Expenses:Misc", "-14")]:
+        tx = Transaction(date=dateutil.parser.parse("2015/01/02"))
+        tx['postings'] = [Posting(account_name=account, amount=Decimal(amount), tx=tx)]
+        txs.append(tx)
+    trie = txs.accounts()
+    assert txs.sum("assets") == 14
+    assert txs.sum("assets:check") == txs.sum("Assets:Checking") == 9
+    assert txs.sum("assets:") == 14 and txs.sum("") == 0 and txs.sum("income") == 0
+    assert [p['amount'] for p in trie.postings("assets:checking")] == [10, -1]
+    assert [(b.name, b.depth, b.total, b.subtotal) for b in trie.balances("assets")] == [
+        ("Assets", 0, 0, 14), ("Assets:Checking", 1, 10, 9), ("Assets:Checking:Fees", 2, -1, -1),
+        ("Assets:Savings", 1, 5, 5)]
+    # Appending updates the trie instead of rebuilding it
+    txs.append(txs[0])
+    assert txs.accounts() is trie and txs.sum("assets") == 24
+    txs.pop()
+    assert txs.accounts() is trie and txs.sum("assets") == 14
+    # A posting to an account the trie hasn't seen clears its parents' totals
+    tx = Transaction(date=dateutil.parser.parse("2015/01/03"))
+    tx['postings'] = [Posting(account_name="Assets:Savings:Jar", amount=Decimal("5"), tx=tx)]
+    txs.append(tx)
+    assert txs.sum("assets") == 19 and txs.sum("assets:savings") == 10
+    # Sorting keeps the trie and the date index
+    dates = txs.date_index()
+    txs.sort(key=lambda tx: tx.postings[0].account_name)
+    assert txs.accounts() is trie and txs.date_index() is dates and txs.sum("assets") == 19
+
+def test_account_trie_edits():
+    txs = Transactions()
+    for account, amount in [("Assets:Checking", "10"), ("Assets:Savings", "5")]:
+        tx = Transaction(date=dateutil.parser.parse("2015/01/02"))
+        tx['postings'] = [Posting(account_name=account, amount=Decimal(amount), tx=tx)]
+        txs.append(tx)
+    assert txs.sum("assets") == 15
+    # Editing a posting in place gets noticed, whichever way it's done
+    txs[0].postings[0].amount = Decimal("20")
+    assert txs.sum("assets") == 25
+    txs[1].postings[0]['account_name'] = "Expenses:Misc"
+    assert txs.sum("assets") == 20 and txs.sum("expenses") == 5
+    # and removing the edited tx takes out what's there now
+    txs.pop()
+    assert txs.sum("expenses") == 0 and txs.sum("") == 20
+    linear = sum([p.amount for tx in txs for p in tx.postings if p.account_name.lower().startswith("assets")])
+    assert txs.sum("assets") == linear
+
+def test_indexes():
+    txs = Transactions()
+    for payee, tags in [("Coffee", {'cc':None}), ("Rent", {}), ("Coffee", {'cc':None, 'owner':'jv'})]:
+        tx = Transaction(date=dateutil.parser.parse("2015/01/02"), payee=payee, tags=tags)
+        tx['postings'] = [Posting(account_name="Expenses:Misc", amount=Decimal("3"), tx=tx)]
+        txs.append(tx)
+    assert txs.lookup('payee', "Coffee") == [txs[0], txs[2]]
+    assert txs.lookup('tag', "cc") == [txs[0], txs[2]] and txs.lookup('tag', "owner") == [txs[2]]
+    assert len(txs.lookup('amount', Decimal("3"))) == 3
+    txs.make_index('early', lambda tx: tx.payee < "Q", lambda tx: tx.payee[0])
+    assert txs.index['early'] == {'C':[txs[0], txs[2]]}
+
+    # Kept up to date as the list changes
+    coffee = txs.pop(0)
+    assert txs.lookup('payee', "Coffee") == [txs[1]]
+    txs.append(coffee)
+    txs.sort(key=lambda tx: tx.payee)
+    assert txs.lookup('payee', "Coffee") == [txs[0], txs[1]] and txs.lookup('payee', "Rent") == [txs[2]]
+    del txs[:2]
+    assert txs.lookup('payee', "Coffee") == [] and txs.lookup('tag', "cc") == []
+    assert txs.index['early'] == {}
+    with pytest.raises(KeyError):
+        txs.lookup('nope', 1)
+
+def test_index_edit_then_remove():
+    txs = Transactions()
+    for payee in ["Coffee", "Rent", "Tea"]:
+        tx = Transaction(date=dateutil.parser.parse("2015/01/02"), payee=payee, code="1")
+        tx['postings'] = [Posting(account_name="Expenses:Misc", amount=Decimal("3"), tx=tx)]
+        txs.append(tx)
+    assert len(txs.lookup('amount', Decimal("3"))) == 3 and len(txs.lookup('code', "1")) == 3
+    # Entries come out under the keys they went in under, edited or not
+    coffee = txs[0]
+    coffee.payee = "Espresso"
+    coffee.code = "2"
+    coffee.postings[0].amount = Decimal("4")
+    txs.remove(coffee)
+    assert txs.lookup('payee', "Coffee") == [] and txs.lookup('payee', "Espresso") == []
+    assert txs.lookup('code', "1") == [txs[0], txs[1]]
+    assert txs.lookup('amount', Decimal("3")) == [txs[0].postings[0], txs[1].postings[0]]
+    # The same tx twice gets indexed twice
+    txs.append(txs[0])
+    assert txs.lookup('payee', "Rent") == [txs[0], txs[0]]
+    txs.pop()
+    assert txs.lookup('payee', "Rent") == [txs[0]]
+    # Bulk removal rebuilds once
+    index = txs.get_index('payee')
+    del txs[:]
+    assert txs.get_index('payee') == {} and txs.get_index('payee') is not index
+    assert txs.index_keys['payee'] == {}
+
+def test_between():
+    txs = Transactions()
+    for date in ["2015/01/05", "2015/01/01", "2015/02/01", "2015/01/05"]:
+        txs.append(Transaction(date=dateutil.parser.parse(date)))
+    jan = txs.between(dateutil.parser.parse("2015/01/01"), dateutil.parser.parse("2015/02/01"))
+    assert [tx.date.day for tx in jan] == [1, 5, 5]
+    assert txs.between(dateutil.parser.parse("2015/01/02")) == [txs[0], txs[3], txs[2]]
+    # appends out of date order still land in the right place
+    txs.append(Transaction(date=dateutil.parser.parse("2015/01/03")))
+    assert [tx.date.day for tx in txs.between(end=dateutil.parser.parse("2015/01/05"))] == [1, 3]
+    txs.pop(0)
+    assert len(txs.between(dateutil.parser.parse("2015/01/05"))) == 2
+    txs.insert(0, Transaction(date=dateutil.parser.parse("2015/01/04"), payee="Early"))
+    assert [tx.date.day for tx in txs.between(end=dateutil.parser.parse("2015/01/05"))] == [1, 3, 4]
+    assert txs.lookup('payee', "Early") == [txs[0]]
+
+def test_dates():
+    import dates
+    assert dates.parse("2015/01/30") == dateutil.parser.parse("2015/01/30")
+    assert dates.parse("01/30") == dateutil.parser.parse("01/30")
+    assert dates.parse("January 30, 2015") == dateutil.parser.parse("January 30, 2015")
+    # the fast path leaves a month over 12 to dateutil
+    assert dates.try_parse("2015/30/01") is None
+    assert dates.try_parse("DEPOSITS") is None
+    assert dates.try_parse("DEPOSITS") is None # the memoized failure
+    with pytest.raises(ValueError):
+        dates.parse("DEPOSITS")
+
+    p = Posting(aux_date="2015/01/03")
+    assert p._aux_date == "2015/01/03"
+    assert p['aux_date'] == dateutil.parser.parse("2015/01/03")
+    assert p._aux_date == p.aux_date
+    assert pickle.loads(pickle.dumps(Posting(aux_date="2015/01/04"))).aux_date.day == 4
+
+    # Bad dates are still caught when they're set
+    assert dates.valid("2016/02/29") and dates.valid("01/30") and dates.valid("January 30, 2015")
+    for text in ["2015/02/30", "2015/02/29", "0000/01/01", "DEPOSITS"]:
+        assert not dates.valid(text)
+        with pytest.raises(ValueError):
+            Posting(aux_date=text)
+        with pytest.raises(ValueError):
+            Transaction(aux_date=text)
+
+def test_integer_cents():
+    import money
+    from errs import ParseError
+    assert money.parse("$-1,234.56") == Decimal("-1234.56")
+    money.cents = True
+    try:
+        assert money.parse("$-1,234.56") == -123456
+        assert money.parse("1.5") == 150
+        assert money.parse("-.05") == -5
+        assert money.parse("1E+2") == 10000
+        with pytest.raises(ParseError):
+            money.parse("0.001")
+        with pytest.raises(ParseError):
+            money.parse("$")
+        assert money.to_decimal(-123456) == Decimal("-1234.56")
+        assert Posting(amount=money.parse("1234.5")).amtstr() == " 1,234.50"
+        assert money.to_cents(150) == (150, True)
+        assert money.from_cents(150) == 150
+    finally:
+        money.cents = False
@@ -1,13 +1,119 @@
-import dateutil, random, re, sys
+import bisect, dateutil, random, re, sys
 from decimal import Decimal, ROUND_HALF_UP
-from operator import itemgetter, attrgetter, methodcaller
+from operator import attrgetter
 from errs import ParseError
+import columns as columnar
+import dates
+import money
+from trie import Account_Trie
 import util as u
 
 # we use this for handling state flags on the payee line or for a posting
 state_flags = {"":"", "cleared":"*", "pending":"!"}
 
-class Posting(dict):
+# buffer size for files we write journals to
+write_buffer = 1 << 16
+
+# Counts in-place edits of a posting's amount or account_name (see
+# tracked). A Transactions drops its account trie and columnar view,
+# which are built from those fields, when this moves.
+edits = 0
+
+def tracked(slot):
+    """Return a property that keeps a Posting field in slot and counts
+    every change to it in edits. Posting.__init__ fills the slot
+    directly, so only edits to existing postings count."""
+    def set(self, val):
+        global edits
+        edits += 1
+        setattr(self, slot, val)
+    return property(attrgetter(slot), set)
+
+class Record(object):
+    """Base class for Posting and Transaction.
+
+    Fields live in __slots__, so a record is a fraction of the size of
+    the dict it used to be and tx.date is a plain attribute read. Enough
+    of the dict interface is kept (tx['date'], in, get, setdefault,
+    update, keys, items) that code written against the old dict
+    versions keeps working while we move it over to attributes. Keys
+    that aren't fields (e.g. the match_* keys the matcher sets) go in
+    self.extra.
+
+    """
+    __slots__ = ('extra',)
+    fields = () # the keys; every one gets a default in __init__
+    optional = () # keys that have a slot but are only there once set
+    keyset = frozenset()
+
+    def __getitem__(self, key):
+        if key in self.keyset:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, val):
+        if key in self.keyset:
+            setattr(self, key, val)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = val
+
+    def __delitem__(self, key):
+        if key in self.optional and hasattr(self, key):
+            delattr(self, key)
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.keyset:
+            return hasattr(self, key)
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, vals):
+        for key, val in vals.items():
+            self[key] = val
+
+    def keys(self):
+        return [key for key in self.fields + self.optional if hasattr(self, key)] + (self.extra.keys() if self.extra else [])
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getstate__(self):
+        return dict([(key, getattr(self, key)) for key in ('extra',) + self.__slots__ if hasattr(self, key)])
+
+    def __setstate__(self, state):
+        for key, val in state.items():
+            setattr(self, key, val)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict([(k, v) for k, v in self.items() if k != 'tx']))
+
+class Posting(Record):
     """A posting for a transaction
 
      * account_name is a string. It starts out blank but eventually
@@ -31,24 +137,34 @@ class Posting(dict):
 
      * tx is the parent transaction, if there is one and it is known
     """
+    fields = ('aux_date', 'account_ref', 'account_name', 'amount', 'commodity',
+              'commodity_flags', 'note', 'state', 'tx')
+    keyset = frozenset(fields)
+    tracked_slots = {'account_name':'_account_name', 'amount':'_amount'}
+    __slots__ = ('account_ref', '_account_name', '_amount') + fields[4:] + ('_aux_date', 'amount_width')
+    aux_date = dates.lazy('_aux_date')
+    account_name = tracked('_account_name')
+    amount = tracked('_amount')
 
     def __init__(self, **initial_vals):
-        dict.__init__(self)
-        self.update({
-            'aux_date':None,
-            'account_ref':'',
-            'account_name':None,
-            'amount':None, 
-            'commodity':'', # usually will be $
-            'commodity_flags':'',
-            'note':"",
-            'state':"",
-            'tx':None,
-        })
+        self.extra = None
+        self.aux_date = None
+        self.account_ref = ''
+        self._account_name = None
+        self._amount = None
+        self.commodity = '' # usually will be $
+        self.commodity_flags = ''
+        self.note = ""
+        self.state = ""
+        self.tx = None
         self.amount_width = None #gets set by self.__unicode__()
-        self.update(initial_vals)
+        for key, val in initial_vals.items():
+            if key in self.tracked_slots:
+                setattr(self, self.tracked_slots[key], val)
+            else:
+                self[key] = val
     def amtstr(self):
-        return (" " if self['amount'] >= 0 else "") + u.moneyfmt(self['amount'])
+        return (" " if self['amount'] >= 0 else "") + u.moneyfmt(money.to_decimal(self['amount']))
     def __str__(self): return unicode(self).encode('utf-8')
     def __unicode__(self):
         state = state_flags[self['state']]
@@ -77,7 +193,7 @@ class Posting(dict):
                 return None
             return self['tx'].get_date("aux_date")
 
-class Transaction(dict):
+class Transaction(Record):
     """
     date is a datetime object with the date of the transaction, when it was posted or the receipt date
 
@@ -101,23 +217,29 @@ class Transaction(dict):
         some useful tags: owner=uid, cc
     """
 
+    fields = ('date', 'aux_date', 'payee', 'postings', 'amount', 'file', 'code',
+              'state', 'note', 'tags')
+    optional = ('fname',) # the journal file we parsed this from, if any
+    keyset = frozenset(fields + optional)
+    __slots__ = ('date', '_aux_date') + fields[2:] + optional
+    aux_date = dates.lazy('_aux_date')
+
     def __init__(self, **initial_vals):
-        dict.__init__(self)
-        self.update({
-            'date':None,
-            'aux_date':None,
-            'payee':"PAYEE UNKNOWN",
-            'postings':[],
-            'amount':0,
-            'file':"", 
-            'code':"",
-            'state':"",
-            'note':"",
-            'tags':{},
-        })
-        if not 'id' in self['tags']:
-            self['tags']['id'] = random.randint(0,10000000)
-        self.update(initial_vals)
+        self.extra = None
+        self.date = None
+        self.aux_date = None
+        self.payee = "PAYEE UNKNOWN"
+        self.postings = []
+        self.amount = 0
+        self.file = ""
+        self.code = ""
+        self.state = ""
+        self.note = ""
+        if not 'tags' in initial_vals:
+            # random.randint is several times slower than this
+            self.tags = {'id':int(random.random() * 10000001)}
+        for key, val in initial_vals.items():
+            self[key] = val
 
     def get_date(self, field="date", posting=None, no_parent=False, return_string=True):
         """If posting is specified, try to get the aux date of the posting
@@ -179,7 +301,7 @@ class Transaction(dict):
                 self['match_amounts'].add(abs(posting['amount']))
                 m = date_pat.search(posting.setdefault('note',''))
                 if m: # there's a date in there in the right format
-                    da = [dateutil.dateparser.parse(m.groups()[0]), abs(posting['amount'])]
+                    da = [dates.parse(m.groups()[0]), abs(posting['amount'])]
                     mda[str(da)] = da
                 else:
                     date = plus_or_minus(self['date'])
@@ -212,72 +334,291 @@ class Transaction(dict):
                 return "\n    ;" + self['note'].replace("\n", "\n    ;")
             return ''
     def __str__(self): return unicode(self).encode('utf-8')
-    def __unicode__(tx):
+    def __unicode__(self):
+        return u"".join(self.chunks())
+    def chunks(tx):
+        """Yield the journal text of this tx a line or so at a time."""
         self = tx # laxy
         #s = self.format_output("date") + " " + self.format_output("state") + self.format_output("code") + tx['payee'] + self.format_output("note") + "\n"
-        s = u"{0} {1}{2}{3}{4}\n".format(self.format_output("date"),
-                                        self.format_output("state"),
-                                        self.format_output("code"),
-                                        tx['payee'],
-                                        self.format_output("note"))
+        yield u"{0} {1}{2}{3}{4}\n".format(self.format_output("date"),
+                                          self.format_output("state"),
+                                          self.format_output("code"),
+                                          tx['payee'],
+                                          self.format_output("note"))
 
         # Print tags
         for tag, val in tx['tags'].items():
             if not val:
                 if not ":%s:" % tag.lower() in tx['note'].lower():
-                    s += "    ; :%s:\n" % tag
+                    yield u"    ; :%s:\n" % tag
             else:
                 if not tag.lower() in [line.split(":",1)[0].strip().lower() for line in tx['note'].split("\n") if ':' in line]:
-                    s += "    ; %s: %s\n" % (tag, val)
+                    yield u"    ; %s: %s\n" % (tag, val)
 
         if 'postings' in tx:
             for posting in tx['postings']:
-                s += unicode(posting)
-                
-        return s
+                yield unicode(posting)
 
 class Transactions(list):
     def __init__(self, loaded=False):
         list.__init__(self)
+        self.view = None
+        self.trie = None
+        self.dates = None # (date ordinals, txs), both in date order
         self.loaded=loaded
-        self.index = {}
-
-    def make_index_postings(self, name, predicate, key_func):
-        """Takes every posting of every tx for which predicate(tx, posting) is
-        true and indexes it under self.index[key_func(tx, posting)]
-
-        If predicate = True, we'll index all the postings.
+        self.indexes = {} # name -> what make_index was told
+        self.index = {} # name -> key -> txs or postings
+        self.index_keys = {} # name -> id(tx) -> [the (key, val) pairs it went in under]
+        self.edits = edits # what edits was when we last checked
+
+    def changed(self, added=None, removed=None, reordered=False):
+        """Bring anything we've derived from the list up to date. The list
+        methods below call this whenever the list changes, saying which
+        txs were added or removed, or that the list was only
+        reordered. Call it yourself, with no arguments, after editing
+        transactions in place and everything gets rebuilt on demand.
 
         """
-        self.index[name] = {}
-        for tx in self:
-            for posting in tx:
-                if predicate or predicate(tx, posting):
-                    key = key_funct(tx, posting)
-                    if not key in self.index[name]:
-                        self.index[name].setdefault(key, []).append(posting)
+        self.check_edits()
+        if removed is not None and len(removed) > 1:
+            # Taking txs out of the trie and indexes one at a time is
+            # quadratic (e.g. del txs[:]), so start over instead.
+            (added, removed, reordered) = (None, None, False)
+        self.view = None # it's by position, so even a reorder spoils it
+        if self.trie is not None:
+            if added is None and removed is None and not reordered:
+                self.trie = None
+            else:
+                for tx in removed or []:
+                    self.trie.remove(tx)
+                for tx in added or []:
+                    self.trie.add(tx)
+        if self.dates is not None:
+            if removed is not None or (added is None and not reordered):
+                self.dates = None
+            else:
+                (keys, txs) = self.dates
+                for tx in added or []:
+                    key = tx.date.toordinal()
+                    if not keys or key >= keys[-1]:
+                        keys.append(key)
+                        txs.append(tx)
+                    else:
+                        idx = bisect.bisect_right(keys, key)
+                        keys.insert(idx, key)
+                        txs.insert(idx, tx)
+        if reordered or (added is None and removed is None):
+            # Index entries are kept in list order, so rebuild
+            for name in self.indexes:
+                self.build_index(name)
+        else:
+            for name in self.indexes:
+                for tx in removed or []:
+                    self.unindex_tx(name, tx)
+                for tx in added or []:
+                    self.index_tx(name, tx)
+
+    def check_edits(self):
+        """Drop the trie and columnar view if a posting's amount or
+        account has been edited in place since we built them."""
+        if self.edits != edits:
+            self.edits = edits
+            self.trie = None
+            self.view = None
+
+    def append(self, tx):
+        list.append(self, tx)
+        self.changed(added=[tx])
+    def extend(self, txs):
+        txs = list(txs)
+        list.extend(self, txs)
+        self.changed(added=txs)
+    def insert(self, idx, tx):
+        list.insert(self, idx, tx)
+        if idx >= len(self) - 1:
+            self.changed(added=[tx])
+        else:
+            # the indexes keep list order, so this counts as a reorder too
+            self.changed(added=[tx], reordered=True)
+    def remove(self, tx):
+        list.remove(self, tx)
+        self.changed(removed=[tx])
+    def pop(self, *args):
+        ret = list.pop(self, *args)
+        self.changed(removed=[ret])
+        return ret
+    def reverse(self):
+        list.reverse(self)
+        self.changed(reordered=True)
+    def __setitem__(self, idx, tx):
+        old = self[idx]
+        list.__setitem__(self, idx, tx)
+        if not isinstance(idx, slice) and idx in (-1, len(self) - 1):
+            self.changed(added=[tx], removed=[old])
+        else:
+            self.changed()
+    def __delitem__(self, idx):
+        old = self[idx]
+        list.__delitem__(self, idx)
+        self.changed(removed=old if isinstance(idx, slice) else [old])
+    def __setslice__(self, i, j, txs):
+        list.__setslice__(self, i, j, txs)
+        self.changed()
+    def __delslice__(self, i, j):
+        old = list.__getslice__(self, i, j)
+        list.__delslice__(self, i, j)
+        self.changed(removed=old)
+    def __iadd__(self, txs):
+        self.extend(txs)
+        return self
+
+    def __getstate__(self):
+        """Derived data gets rebuilt on demand, so don't pickle it. Index
+        declarations may hold lambdas, which can't be pickled, so they
+        get dropped too. Standard indexes come back on first lookup."""
+        state = dict(self.__dict__)
+        state['view'] = None
+        state['trie'] = None
+        state['dates'] = None
+        state['indexes'] = {}
+        state['index'] = {}
+        state['index_keys'] = {}
+        return state
+
+    def accounts(self):
+        """Return a trie.Account_Trie of our postings, building it the
+        first time."""
+        self.check_edits()
+        if self.trie is None:
+            self.trie = Account_Trie(self)
+        return self.trie
+
+    def date_index(self):
+        """Return (keys, txs): our txs sorted by date and a parallel list
+        of their dates as day ordinals, building them the first time."""
+        if self.dates is None:
+            txs = sorted(self, key=attrgetter('date'))
+            self.dates = ([tx.date.toordinal() for tx in txs], txs)
+        return self.dates
+
+    def between(self, start=None, end=None):
+        """Return the txs dated on or after start and before end (dates
+        or datetimes, either can be None) as a new Transactions, in
+        date order. Finding them is a bisect of the date index, so
+        narrowing a loaded ledger to a date range doesn't mean going
+        back to ledger with -b and -e."""
+        (keys, txs) = self.date_index()
+        lo = bisect.bisect_left(keys, start.toordinal()) if start else 0
+        hi = bisect.bisect_left(keys, end.toordinal()) if end else len(keys)
+        ret = Transactions()
+        ret.extend(txs[lo:hi])
+        return ret
 
-    def make_index(self, name, predicate=None, key_func=None):
-        """Takes every tx for which predicate(tx) is true and indexes it under
-        key_func(tx).
+    def columns(self):
+        """Return a columns.Columns view of the transactions, building it
+        if the list changed since we last did. None if NumPy isn't
+        installed."""
+        if not columnar.available:
+            return None
+        self.check_edits()
+        if self.view is None:
+            self.view = columnar.Columns(self)
+        return self.view
+
+    # Indexes that lookup() declares the first time they're asked for,
+    # as (postings, predicate, key_func, multi). See make_index.
+    standard_indexes = {
+        'payee':(False, None, lambda tx: tx.payee, False),
+        'code':(False, lambda tx: tx.code, lambda tx: tx.code, False),
+        'fname':(False, lambda tx: 'fname' in tx, lambda tx: tx.fname, False),
+        'tag':(False, None, lambda tx: tx.tags.keys(), True),
+        'amount':(True, lambda tx, posting: posting.amount is not None, lambda tx, posting: posting.amount, False),
+    }
+
+    def make_index(self, name, predicate=None, key_func=None, multi=False):
+        """Declare an index of the txs for which predicate(tx) is true,
+        keyed by key_func(tx), and build it. self.index[name] maps each
+        key to a list of txs in list order. From now on it is kept up
+        to date as the list changes.
+
+        If predicate is None or True, we'll index all the transactions.
+        If multi is True, key_func returns a list of keys and the tx is
+        indexed under each of them (e.g. its tags).
 
-        If predicate = True, we'll index all the transactions.
         """
+        self.indexes[name] = (False, predicate, key_func, multi)
+        self.build_index(name)
+
+    def make_index_postings(self, name, predicate, key_func, multi=False):
+        """Like make_index, but index every posting of every tx for which
+        predicate(tx, posting) is true, under key_func(tx, posting)."""
+        self.indexes[name] = (True, predicate, key_func, multi)
+        self.build_index(name)
+
+    def drop_index(self, name):
+        self.indexes.pop(name, None)
+        self.index.pop(name, None)
+        self.index_keys.pop(name, None)
+
+    def index_entries(self, name, tx):
+        """Yield the (key, tx or posting) pairs index name has for tx."""
+        (postings, predicate, key_func, multi) = self.indexes[name]
+        if postings:
+            items = [((tx, posting), posting) for posting in tx.postings]
+        else:
+            items = [((tx,), tx)]
+        for args, val in items:
+            if predicate is None or predicate is True or predicate(*args):
+                if multi:
+                    for key in key_func(*args):
+                        yield (key, val)
+                else:
+                    yield (key_func(*args), val)
+
+    def index_tx(self, name, tx):
+        """Add tx to index name, remembering the keys it went in under."""
+        entries = list(self.index_entries(name, tx))
+        index = self.index[name]
+        for key, val in entries:
+            index.setdefault(key, []).append(val)
+        self.index_keys[name].setdefault(id(tx), []).append(entries)
+
+    def unindex_tx(self, name, tx):
+        """Take tx out of index name. We use the keys it went in under,
+        not its fields, which may have been edited since."""
+        stack = self.index_keys[name][id(tx)]
+        entries = stack.pop()
+        if not stack:
+            del self.index_keys[name][id(tx)]
+        index = self.index[name]
+        for key, val in entries:
+            index[key].remove(val)
+            if not index[key]:
+                del index[key]
+
+    def build_index(self, name):
         self.index[name] = {}
+        self.index_keys[name] = {}
         for tx in self:
-            if predicate or predicate(tx):
-                key = key_func(tx)
-                if not key in self.index[name]:
-                    self.index[name].setdefault(key, []).append(tx)
+            self.index_tx(name, tx)
+
+    def get_index(self, name):
+        """Return index name, a dict of key -> list of txs (or postings).
+        Don't modify it. Standard indexes get made on first use."""
+        if not name in self.indexes:
+            if not name in self.standard_indexes:
+                raise KeyError("No index named %s" % name)
+            self.indexes[name] = self.standard_indexes[name]
+            self.build_index(name)
+        return self.index[name]
+
+    def lookup(self, name, key):
+        """Return the txs (or postings) index name has under key."""
+        return self.get_index(name).get(key, [])
 
     def sum(self, account):
         """Add up all the amounts in accounts that start with account."""
-        ret = 0
-        for tx in self:
-            for posting in tx['postings']:
-                if posting['account_name'].lower().startswith(account.lower()):
-                    ret += posting['amount']
-        return ret
+        return self.accounts().sum(account)
     def load_from_statements(self, *args, **kwargs):
         """Pull transactions from some version of a bank statement, either PDF, XML, CVS or whatever.
 
@@ -298,8 +639,9 @@ class Transactions(list):
 
     def sort(self, key = None):
         if not key:
-            key = itemgetter('date', 'amount')
+            key = attrgetter('date')
         list.sort(self, key=key)
+        self.changed(reordered=True)
 
     def make_match_date_amounts(self):
         for tx in self:
@@ -317,11 +659,15 @@ class Transactions(list):
             elif tx['match_tx']:
                 tx['tags']['possible_match_dates'] = [otx.get_date() for otx in tx['match_tx']]
     def write(self, fname):
-        with open(fname, 'w') as OUTF:
-            OUTF.write(self.__unicode__().encode('utf8'))
-    def __unicode__(self):
-        ret = ''
+        with open(fname, 'w', write_buffer) as OUTF:
+            self.write_to(OUTF)
+    def write_to(self, OUTF):
+        """Write the journal text of each tx to the open file OUTF, utf-8
+        encoded, one tx at a time. We never hold more than one tx's
+        text, so memory use doesn't grow with the size of the book;
+        OUTF's buffer turns the small writes into big ones."""
         for tx in self:
-            ret += unicode(tx) + "\n"
-        return ret
+            OUTF.write((u"".join(tx.chunks()) + u"\n").encode('utf8'))
+    def __unicode__(self):
+        return u"".join([unicode(tx) + u"\n" for tx in self])
     def __str__(self): return unicode(self).encode('utf-8')
@@ -0,0 +1,128 @@
+"""An index of postings by account name.
+
+Account names are colon separated paths (Assets:Checking:Deposits), so
+we keep the postings in a trie with one node per segment. Each node
+holds the postings made directly to that account and caches its own
+total and the total of its subtree. Adding a posting only forgets the
+cached totals along its path, so once the totals are worked out, a
+prefix sum costs O(depth) however many postings there are.
+
+Lookups ignore case and treat the query as a string prefix, the same
+way Transactions.sum always has. "assets:check" covers
+Assets:Checking, because the last segment of the query may be
+partial.
+
+"""
+from namespace import Namespace
+
+class Node(object):
+    __slots__ = ('name', 'parent', 'children', 'postings', 'own', 'sub')
+    def __init__(self, name, parent):
+        self.name = name # the full account name, as first seen
+        self.parent = parent
+        self.children = {} # lowercased segment -> Node
+        self.postings = []
+        self.own = None # cached total of self.postings
+        self.sub = None # cached total of this node and everything under it
+
+    def total(self):
+        if self.own is None:
+            self.own = sum([p.amount for p in self.postings if p.amount is not None])
+        return self.own
+
+    def subtotal(self):
+        if self.sub is None:
+            self.sub = self.total() + sum([child.subtotal() for child in self.children.values()])
+        return self.sub
+
+    def walk(self):
+        """Yield this node and every node under it, depth first."""
+        yield self
+        for key in sorted(self.children):
+            for node in self.children[key].walk():
+                yield node
+
+class Account_Trie(object):
+    def __init__(self, txs=()):
+        self.root = Node("", None)
+        self.nodes = {} # account name -> Node, so adding skips the walk
+        for tx in txs:
+            self.add(tx)
+
+    def node(self, account_name):
+        """Return the node for account_name, making it (and its parents)
+        if need be."""
+        if account_name in self.nodes:
+            return self.nodes[account_name]
+        node = self.root
+        segments = account_name.split(":")
+        for idx, segment in enumerate(segments):
+            key = segment.lower()
+            if not key in node.children:
+                # The new node has no cached subtotal, so its parents
+                # can't keep theirs (see add)
+                parent = node
+                while parent is not None and parent.sub is not None:
+                    parent.sub = None
+                    parent = parent.parent
+                node.children[key] = Node(":".join(segments[:idx+1]), node)
+            node = node.children[key]
+        self.nodes[account_name] = node
+        return node
+
+    def add(self, tx):
+        """Index the postings of tx."""
+        for p in tx.postings:
+            node = self.node(p.account_name)
+            node.postings.append(p)
+            node.own = None
+            # A node's cached subtotal implies its children's are
+            # cached, so we can stop at the first one that isn't.
+            while node is not None and node.sub is not None:
+                node.sub = None
+                node = node.parent
+
+    def remove(self, tx):
+        """Stop indexing the postings of tx."""
+        for p in tx.postings:
+            node = self.node(p.account_name)
+            node.postings.remove(p)
+            node.own = None
+            while node is not None and node.sub is not None:
+                node.sub = None
+                node = node.parent
+
+    def find(self, prefix):
+        """Return the nodes whose accounts (and subtrees) are exactly the
+        accounts that start with prefix, ignoring case."""
+        segments = prefix.lower().split(":")
+        node = self.root
+        for segment in segments[:-1]:
+            node = node.children.get(segment)
+            if node is None:
+                return []
+        last = segments[-1]
+        return [child for key, child in node.children.items() if key.startswith(last)]
+
+    def sum(self, prefix):
+        """The total of the postings to accounts that start with prefix."""
+        return sum([node.subtotal() for node in self.find(prefix)])
+
+    def postings(self, prefix):
+        """Yield the postings to accounts that start with prefix."""
+        for top in self.find(prefix):
+            for node in top.walk():
+                for p in node.postings:
+                    yield p
+
+    def balances(self, prefix=""):
+        """Return the balance of each account under prefix as a list of
+        Namespaces with name, depth, total (postings made directly to
+        the account) and subtotal (the account and everything under
+        it), in tree order."""
+        ret = []
+        for top in sorted(self.find(prefix), key=lambda node: node.name.lower()):
+            for node in top.walk():
+                ret.append(Namespace({'name':node.name, 'depth':node.name.count(":"),
+                                      'total':node.total(), 'subtotal':node.subtotal()}))
+        return ret
@@ -24,6 +24,24 @@ def fix_path(path, head='/'):
             raise IOError(2, "File %s not found." % path)
     return path
 
+def totals_before(items, cutoffs):
+    """items is a list of (date, amount) pairs in any order. Return a
+    list with, for each date in cutoffs, the sum of the amounts dated
+    strictly before it. Sorts both lists once and walks them together,
+    so it's O(n log n + m log m) rather than O(n * m).
+
+    """
+    items = sorted(items, key=lambda item: item[0])
+    ret = [0] * len(cutoffs)
+    total = 0
+    idx = 0
+    for (n, cutoff) in sorted(enumerate(cutoffs), key=lambda c: c[1]):
+        while idx < len(items) and items[idx][0] < cutoff:
+            total += items[idx][1]
+            idx += 1
+        ret[n] = total
+    return ret
+
 def shellquote(s):
     return "'" + s.replace("'", "'\\''") + "'"
 